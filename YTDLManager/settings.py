@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'music_manager.utils.profiling.QueryProfileMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -60,7 +61,7 @@ ROOT_URLCONF = 'YTDLManager.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'music_manager.utils.profiling.ProfilingTemplates',  # DjangoTemplates that reports render time to the query profiler
         'DIRS': [BASE_DIR / "templates"],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,6 +76,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'YTDLManager.wsgi.application'
+TEST_RUNNER = 'music_manager.utils.testing.ModelsOnlyTestRunner'  # Test databases are made from the models, see music_manager/utils/testing.py
 
 
 # Database
@@ -141,3 +143,120 @@ YT_MUSIC_OAUTH_FILE = BASE_DIR / 'ytmusic_oauth'  # Directory to store OAuth fil
 YT_MUSIC_HEADERS_FILE = BASE_DIR / 'ytmusic_headers.json'  # Default headers file
 
 FIELD_ENCRYPTION_KEY=os.getenv('FIELD_ENCRYPTION_KEY')
+
+# Background YouTube Music sync (see music_manager/utils/sync.py)
+SYNC_SUBSCRIPTION_LIMIT = 300  # Subscriptions fetched per library sync
+SYNC_MAX_ATTEMPTS = 3  # Attempts per artist/album before the task is marked failed
+SYNC_RETRY_BACKOFF = 30  # Seconds, multiplied by the number of previous attempts
+SYNC_POLL_INTERVAL = 5  # Seconds between queue checks in run_sync_worker
+
+# Adaptive rate limit shared by all ytmusicapi calls (see music_manager/utils/ratelimit.py)
+YTMUSIC_RATE_INITIAL = 1.0  # Requests per second to start with
+YTMUSIC_RATE_MIN = 0.1
+YTMUSIC_RATE_MAX = 5.0
+YTMUSIC_RATE_BURST = 3  # Requests that may be sent back to back
+YTMUSIC_RATE_INCREASE = 0.05  # Added to the rate after each healthy response
+YTMUSIC_RATE_DECREASE = 0.5  # Rate multiplier after a 429/5xx response
+YTMUSIC_MAX_RETRIES = 4  # Retries of a throttled call before giving up
+YTMUSIC_MAX_WORKERS = 4  # Concurrent ytmusicapi calls per process
+YTMUSIC_WRITE_BATCH = 50  # Fetched items written per database transaction
+
+# On-disk cache of raw ytmusicapi responses (see music_manager/utils/cache.py)
+YTMUSIC_CACHE_PATH = BASE_DIR / 'ytmusic_cache.sqlite3'
+YTMUSIC_CACHE_MAX_BYTES = 256 * 1024 * 1024
+YTMUSIC_CACHE_TTLS = {  # Seconds, only these endpoints are cached
+    'get_artist': 24 * 60 * 60,
+    'get_artist_albums': 24 * 60 * 60,
+    'get_album': 7 * 24 * 60 * 60,
+    'get_song': 30 * 24 * 60 * 60,
+}
+
+# Per-user YTMusic client pool (see music_manager/utils/ytmusic.py)
+YTMUSIC_CLIENT_IDLE_TIMEOUT = 15 * 60  # Seconds before an unused client is dropped
+YTMUSIC_REQUEST_TIMEOUT = 30  # Seconds, same as ytmusicapi's default session
+SYNC_ALBUM_REFRESH_AGE = 30 * 24 * 60 * 60  # Seconds before an album sync re-checks a track list
+SYNC_ALBUM_RETRY_AFTER = 60 * 60  # Seconds before an album page re-queues a track list whose fetch failed
+SYNC_ASYNC_JOBS = 4  # Jobs run side by side by run_sync_worker --async
+SYNC_ASYNC_TASKS_PER_JOB = 4  # Artists/albums of one job synced at once
+SYNC_ASYNC_API_CALLS = 8  # ytmusicapi calls in flight across all async jobs
+
+# Library listings (see music_manager/utils/pagination.py)
+LIBRARY_PAGE_SIZE = 50  # Artists/albums per page
+LIBRARY_MAX_PAGE_SIZE = 200  # Upper bound for ?limit= and songs per expanded album
+
+# Download worker (see downloader/utils/worker.py)
+DOWNLOAD_ROOT = BASE_DIR / 'downloads'
+DOWNLOAD_OUTTMPL = '%(uploader,channel|Unknown)s/%(title)s [%(id)s].%(ext)s'  # yt-dlp output template under DOWNLOAD_ROOT
+DOWNLOAD_FORMAT = 'bestaudio/best'
+DOWNLOAD_WORKERS = os.cpu_count() or 2  # yt-dlp processes run at once
+DOWNLOAD_MAX_ATTEMPTS = 3  # Attempts per URL before it is marked failed
+DOWNLOAD_POLL_INTERVAL = 5  # Seconds between queue checks in run_download_worker
+DOWNLOAD_CONCURRENT_FRAGMENTS = 4  # Fragments of one HLS/DASH download fetched at once, overridable per URL
+DOWNLOAD_STORE_ROOT = DOWNLOAD_ROOT / '.store'  # Same filesystem as DOWNLOAD_ROOT so files can be hardlinked (see downloader/utils/store.py)
+DOWNLOAD_STORE_MAX_BYTES = 50 * 1024 * 1024 * 1024  # Least recently used files are evicted past this
+DOWNLOAD_PROGRESS_INTERVAL = 1.0  # Seconds between progress writes per download
+DOWNLOAD_METRICS_WINDOW = 15 * 60  # Seconds of finished downloads the throughput figures cover
+DOWNLOAD_METADATA_TTL = 5 * 60 * 60  # Seconds cached extract_info results are reused, below YouTube's ~6h signed URL lifetime
+
+# Library search (see music_manager/utils/search.py)
+SEARCH_BACKEND = 'auto'  # 'auto' uses SQLite FTS5 when available, 'memory' forces the in-process index
+SEARCH_RESULTS_LIMIT = 50
+SEARCH_TYPEAHEAD_LIMIT = 10
+SEARCH_MEMORY_REFRESH = 30  # Seconds between the in-memory index's checks for rows other processes created
+
+# Cover art pipeline (see music_manager/utils/covers.py)
+COVER_ART_ROOT = BASE_DIR / 'covers'  # Originals and thumbnails, named by content hash
+COVER_ART_SIZES = (60, 120, 300)  # Square thumbnail edges in pixels, each made as WebP and JPEG
+COVER_ART_WORKERS = 8  # Images downloaded and resized at once
+COVER_ART_TIMEOUT = 15  # Seconds per image request
+COVER_ART_MAX_BYTES = 10 * 1024 * 1024  # Larger downloads are abandoned
+COVER_ART_BATCH = 200  # Artists/albums handled per idle pass of run_sync_worker
+COVER_ART_RETRY_BACKOFF = 15 * 60  # Seconds before a failed image is fetched again, doubled after each further failure
+COVER_ART_RETRY_MAX = 7 * 24 * 60 * 60  # Upper bound of that wait, so images gone for good are only retried weekly
+COVER_ART_CACHE_SECONDS = 365 * 24 * 60 * 60  # max-age of served thumbnails, their URLs change with the content
+
+# Metrics and logging (see music_manager/utils/metrics.py)
+METRICS_DIR = BASE_DIR / 'metrics'  # Each process's metrics are written here for /metrics to add up, None keeps them per process
+METRICS_FLUSH_INTERVAL = 10  # Seconds between writes of a process's metrics file
+METRICS_MAX_AGE = 24 * 60 * 60  # Seconds after which /metrics deletes a process file nobody wrote, e.g. of another host's exited process
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # Bearer token a Prometheus scraper sends, staff users can always read /metrics
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG also logs every YouTube Music call and sync step with its duration
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'json' writes one JSON object per line with the structured fields
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {'format': '{asctime} {levelname} {name} {message}', 'style': '{'},
+        'json': {'()': 'music_manager.utils.logs.JSONFormatter'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': LOG_FORMAT},
+    },
+    'loggers': {
+        'music_manager': {'handlers': ['console'], 'level': LOG_LEVEL},
+        'downloader': {'handlers': ['console'], 'level': LOG_LEVEL},
+    },
+}
+
+# Per request query profiling and budgets (see music_manager/utils/profiling.py)
+QUERY_PROFILE_ENABLED = True
+QUERY_PROFILE_HEADERS = DEBUG  # Server-Timing, X-Query-Count and X-Query-Budget response headers
+QUERY_PROFILE_SLOWEST = 3  # Slowest statements kept per request for the log
+QUERY_PROFILE_SLOW_MS = 100  # A request with a statement at least this slow is logged as a warning
+# View name -> most queries a request may run, session and auth lookups included, as measured by
+# music_manager/tests.py. Album pages are budgeted for polling a queued album, the one request
+# that queues it runs more.
+QUERY_BUDGETS = {
+    'music_manager:home': 7,
+    'music_manager:manage_artists': 4,
+    'music_manager:manage_likes': 8,
+    'music_manager:artists_information': 3,
+    'music_manager:artist_info': 4,
+    'music_manager:album_info': 6,
+    'music_manager:album_tracks': 6,
+    'music_manager:search': 4,
+    'music_manager:search_typeahead': 3,
+}
+QUERY_BUDGET_DEFAULT = None  # Budget of views missing from QUERY_BUDGETS, None for no limit
+QUERY_BUDGET_STRICT = False  # Raise QueryBudgetExceeded instead of logging, for test runs
@@ -22,6 +22,6 @@ from downloader.views import index
 urlpatterns = [
     path("", include("music_manager.urls")),
     path("accounts/", include("django.contrib.auth.urls")),
-    path("downloads", include("downloader.urls")),
+    path("downloads/", include("downloader.urls")),
     path('admin/', admin.site.urls),
 ]
@@ -1,4 +1,8 @@
 from django import forms
 
 class SubmitUrl(forms.Form):
-    url = forms.URLField(label="Input Video URL", max_length= 100)
\ No newline at end of file
+    url = forms.URLField(label="Input Video URL", max_length= 100)
+    concurrent_fragments = forms.IntegerField(
+        label="Parallel fragments", min_value=1, max_value=16, required=False,
+        help_text="Fragments of a segmented stream downloaded at once",
+    )
\ No newline at end of file
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from downloader.utils.worker import run_worker
+
+
+class Command(BaseCommand):
+    help = "Download queued URLs with yt-dlp in a pool of worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Exit once the queue is empty instead of polling for new downloads",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=None,
+            help="Seconds to wait between queue checks (defaults to DOWNLOAD_POLL_INTERVAL)",
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help="Downloads run at once (defaults to DOWNLOAD_WORKERS)",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Download worker started")
+        try:
+            run_worker(
+                workers=options['workers'],
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            # Items still running are put back in the queue when the worker restarts
+            self.stdout.write("Download worker stopped")
@@ -1,7 +1,60 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 # Create your models here.
+class StoredMedia(models.Model):
+    """
+    One downloaded file in the content-addressed store, shared by every
+    request for the same video in the same format
+    """
+    video_id = models.CharField(max_length=255)  # "<extractor key>:<id>", e.g. "Youtube:dQw4w9WgXcQ"
+    format = models.CharField(max_length=255)  # yt-dlp format selector it was downloaded with
+    path = models.CharField(max_length=500)
+    filename = models.CharField(max_length=500)  # Readable name the file is linked as under DOWNLOAD_ROOT
+    size = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('video_id', 'format')
+        indexes = [
+            # Eviction order
+            models.Index(fields=['last_used']),
+        ]
+        verbose_name_plural = "Stored media"
+
+    def __str__(self):
+        return f"{self.video_id} ({self.format})"
+
+class MediaMetadata(models.Model):
+    """
+    Sanitized yt-dlp info for a video, reused instead of extracting again
+    until it is DOWNLOAD_METADATA_TTL seconds old
+    """
+    video_id = models.CharField(max_length=255, unique=True)  # "<extractor key>:<id>", as in StoredMedia
+    url = models.URLField(max_length=500)  # Last URL it was extracted from
+    title = models.CharField(max_length=500, blank=True, null=True)
+    info = models.JSONField()
+    fetched_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Lookup of URLs yt-dlp can't identify without extracting
+            models.Index(fields=['url']),
+        ]
+        verbose_name_plural = "Media metadata"
+
+    def __str__(self):
+        return self.title or self.video_id
+
+    @property
+    def is_fresh(self):
+        return self.fetched_at >= timezone.now() - timedelta(seconds=settings.DOWNLOAD_METADATA_TTL)
+
 class DownloadedFiles(models.Model):
     user = models.CharField(max_length=200)
     url = models.URLField(max_length=500)
@@ -10,13 +63,74 @@ class DownloadedFiles(models.Model):
     author_url = models.URLField(max_length=500)
     playlist = models.CharField(max_length=200, blank=True, null=True)
     content = models.TextField(blank=True, null=True)
+    file_path = models.CharField(max_length=500, blank=True, null=True)
+    media = models.ForeignKey(StoredMedia, on_delete=models.SET_NULL, blank=True, null=True, related_name='files')
+    metadata = models.ForeignKey(MediaMetadata, on_delete=models.SET_NULL, blank=True, null=True, related_name='files')
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.title or self.url
 
 class DownloadQueue(models.Model):
+    """A URL waiting for, or being processed by, the download worker"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
     user = models.CharField(max_length=200)
     url = models.URLField(max_length=500)
+    # Set on the items a playlist URL was expanded into
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, blank=True, null=True, related_name='entries')
+    playlist = models.CharField(max_length=200, blank=True, null=True)
+    # yt-dlp's concurrent_fragment_downloads, DOWNLOAD_CONCURRENT_FRAGMENTS when unset
+    concurrent_fragments = models.PositiveSmallIntegerField(blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    # Written by the worker from yt-dlp's progress hooks, at most every DOWNLOAD_PROGRESS_INTERVAL
+    downloaded_bytes = models.PositiveBigIntegerField(default=0)
+    total_bytes = models.PositiveBigIntegerField(blank=True, null=True)
+    speed = models.FloatField(blank=True, null=True)  # Bytes per second
+    eta = models.PositiveIntegerField(blank=True, null=True)  # Seconds
+    downloaded_file = models.ForeignKey(DownloadedFiles, on_delete=models.SET_NULL, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True, )
-    finished_at = models.DateTimeField(blank=True, null=True)
\ No newline at end of file
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            # The worker's claim query
+            models.Index(fields=['status', 'created_at']),
+            # Throughput over recently finished items
+            models.Index(fields=['finished_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.url} ({self.status})"
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    def progress(self):
+        """Summary used by the progress endpoint"""
+        return {
+            'id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'downloaded_bytes': self.downloaded_bytes,
+            'total_bytes': self.total_bytes,
+            'percent': int(self.downloaded_bytes * 100 / self.total_bytes) if self.total_bytes else None,
+            'speed': self.speed,
+            'eta': self.eta,
+            'error': self.error,
+        }
@@ -1,3 +1,51 @@
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from downloader.models import DownloadedFiles, DownloadQueue, StoredMedia
+from downloader.utils import worker
+
+
+class FinishItemTests(TestCase):
+    def setUp(self):
+        self.item = DownloadQueue.objects.create(
+            user='worker', url='https://www.youtube.com/watch?v=abc', status=DownloadQueue.STATUS_RUNNING, attempts=1,
+        )
+        self.media = StoredMedia.objects.create(
+            video_id='Youtube:abc', format='bestaudio/best', path='/store/abc.m4a', filename='abc.m4a',
+            size=10, last_used=timezone.now(),
+        )
+        self.result = {
+            'info': {'title': 'Song', 'playlist_title': 'x' * 500},
+            'file_path': '/tmp/abc.m4a',
+            'filename': 'abc.m4a',
+        }
+
+    def patch_store(self, **kwargs):
+        patches = {
+            'add': mock.Mock(return_value=self.media),
+            'link': mock.Mock(return_value='/downloads/abc.m4a'),
+            'enforce_quota': mock.Mock(),
+            **kwargs,
+        }
+        patcher = mock.patch.multiple(worker.store, **patches)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metadata = mock.patch.object(worker.metadata, 'save', return_value=None)
+        metadata.start()
+        self.addCleanup(metadata.stop)
+
+    def test_long_playlist_title_is_cut(self):
+        self.patch_store()
+        self.assertTrue(worker.settle(self.item, self.result))
+        downloaded = DownloadedFiles.objects.get()
+        self.assertEqual(len(downloaded.playlist), DownloadedFiles._meta.get_field('playlist').max_length)
 
-# Create your tests here.
+    def test_error_recording_the_outcome_fails_the_item(self):
+        self.patch_store(link=mock.Mock(side_effect=OSError("Invalid cross-device link")))
+        with self.assertLogs(worker.logger, 'ERROR'):
+            self.assertFalse(worker.settle(self.item, self.result))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, DownloadQueue.STATUS_FAILED)
+        self.assertEqual(self.item.error, "Invalid cross-device link")
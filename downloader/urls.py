@@ -6,7 +6,8 @@ app_name = "downloader"
 urlpatterns = [
     path("", views.index, name="home"),
     #path("<str:user>/", views.requests, name="requests"),
-    #path("<str:user>/<int:item_id>/", views.item, name="item"),
+    path("<str:user>/<int:item_id>/", views.item, name="item"),
     path("download/", views.download, name="download"),
+    path("progress/", views.progress, name="progress"),
     path("completed/", views.completed, name="completed")
 ]
\ No newline at end of file
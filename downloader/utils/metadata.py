@@ -0,0 +1,42 @@
+# utils/metadata.py
+"""
+Cache of sanitized extract_info results. Extraction is one of the slowest
+steps of a download, and a fresh cached info dict can be handed straight
+to yt-dlp's process_ie_result to pick a format and download.
+"""
+import logging
+
+from django.db.models import Q
+from django.utils import timezone
+from yt_dlp import YoutubeDL
+
+from downloader.models import MediaMetadata
+from downloader.utils.store import canonical_id, info_id
+
+logger = logging.getLogger(__name__)
+
+
+def lookup(url, fresh=True):
+    """The cached metadata for a URL, or None. With fresh=False expired entries are returned too."""
+    video_id = canonical_id(url)
+    lookup = Q(url=url) if video_id is None else Q(video_id=video_id) | Q(url=url)
+    metadata = MediaMetadata.objects.filter(lookup).order_by('-fetched_at').first()
+    if metadata is None or (fresh and not metadata.is_fresh):
+        return None
+    return metadata
+
+
+def save(url, info):
+    """Cache the info dict of a single video extracted from url"""
+    # Drop what only describes one download (file paths, chosen formats) so it can be reprocessed
+    info = YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    metadata, _ = MediaMetadata.objects.update_or_create(
+        video_id=info_id(info),
+        defaults={
+            'url': url,
+            'title': (info.get('title') or '')[:500] or None,
+            'info': info,
+            'fetched_at': timezone.now(),
+        },
+    )
+    return metadata
@@ -0,0 +1,40 @@
+# utils/stats.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from downloader.models import DownloadQueue
+
+
+def throughput(window=None):
+    """
+    Aggregate download throughput over the last `window` seconds, used to
+    size DOWNLOAD_WORKERS against real load
+    """
+    window = window or settings.DOWNLOAD_METRICS_WINDOW
+    since = timezone.now() - timedelta(seconds=window)
+    # Expanded playlists and files reused from the store didn't transfer anything themselves
+    downloaded = Q(status=DownloadQueue.STATUS_DONE, downloaded_bytes__gt=0)
+    failed = Q(status=DownloadQueue.STATUS_FAILED)
+    totals = DownloadQueue.objects.filter(finished_at__gte=since).aggregate(
+        completed=Count('id', filter=downloaded),
+        failed=Count('id', filter=failed),
+        bytes=Sum('downloaded_bytes', filter=downloaded),
+    )
+    queued = dict(
+        DownloadQueue.objects.filter(status__in=DownloadQueue.ACTIVE_STATUSES)
+        .values_list('status').annotate(Count('id')).order_by()
+    )
+    finished = totals['completed'] + totals['failed']
+    return {
+        'window': window,
+        'completed': totals['completed'],
+        'failed': totals['failed'],
+        'mb_per_second': round((totals['bytes'] or 0) / window / 1_000_000, 3),
+        'jobs_per_minute': round(totals['completed'] * 60 / window, 2),
+        'failure_rate': round(totals['failed'] / finished, 3) if finished else 0.0,
+        'running': queued.get(DownloadQueue.STATUS_RUNNING, 0),
+        'pending': queued.get(DownloadQueue.STATUS_PENDING, 0),
+    }
@@ -0,0 +1,136 @@
+# utils/store.py
+"""
+Content-addressed store of downloaded media. Files live once under
+DOWNLOAD_STORE_ROOT, keyed by the extractor's canonical video id and the
+format selector, and every request for them gets a hardlink with a readable
+name under DOWNLOAD_ROOT. The least recently used files are evicted once the
+store grows past DOWNLOAD_STORE_MAX_BYTES.
+"""
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+from yt_dlp.extractor import gen_extractor_classes
+
+from downloader.models import DownloadedFiles, StoredMedia
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1024)
+def canonical_id(url):
+    """
+    "<extractor key>:<id>" for a URL that names a single video, worked out
+    from the URL alone so youtu.be, music.youtube.com and extra query
+    parameters all map to the same key. None when only extracting can tell.
+    """
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == 'Generic' or not ie.suitable(url):
+            continue
+        if getattr(ie, '_RETURN_TYPE', None) != 'video':
+            # e.g. a watch URL with a list= parameter, matched by the playlist extractor first
+            return None
+        video_id = ie.get_temp_id(url)
+        return f"{ie.ie_key()}:{video_id}" if video_id else None
+    return None
+
+
+def info_id(info):
+    return f"{info['extractor_key']}:{info['id']}"
+
+
+def store_template(format=None):
+    """yt-dlp output template that writes into the store"""
+    format_key = hashlib.sha1((format or settings.DOWNLOAD_FORMAT).encode()).hexdigest()[:12]
+    return str(Path(settings.DOWNLOAD_STORE_ROOT) / '%(extractor_key)s' / '%(id)s' / f'{format_key}.%(ext)s')
+
+
+def find(url, format=None):
+    """The stored media for a URL if it is already on disk"""
+    video_id = canonical_id(url)
+    if video_id is None:
+        return None
+    media = StoredMedia.objects.filter(video_id=video_id, format=format or settings.DOWNLOAD_FORMAT).first()
+    if media is None:
+        return None
+    if not os.path.exists(media.path):
+        logger.warning(f"Stored file for {media} is missing, downloading it again")
+        media.delete()
+        return None
+    return media
+
+
+def add(info, path, filename, format=None):
+    """Record a freshly downloaded file in the store"""
+    media, _ = StoredMedia.objects.update_or_create(
+        video_id=info_id(info),
+        format=format or settings.DOWNLOAD_FORMAT,
+        defaults={
+            'path': path,
+            'filename': filename,
+            'size': os.path.getsize(path),
+            'last_used': timezone.now(),
+        },
+    )
+    return media
+
+
+def link(media):
+    """
+    Hardlink the stored file to its readable name under DOWNLOAD_ROOT and
+    return that path. Falls back to the store path if linking isn't possible.
+    """
+    media.last_used = timezone.now()
+    media.save(update_fields=['last_used'])
+
+    target = Path(settings.DOWNLOAD_ROOT) / media.filename
+    try:
+        if target.exists():
+            if os.path.samefile(target, media.path):
+                return str(target)
+            target.unlink()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.link(media.path, target)
+    except OSError as e:
+        logger.warning(f"Could not link {media.path} to {target}, using the stored file: {e}")
+        return media.path
+    return str(target)
+
+
+def evict(media):
+    """Delete a stored file and the links handed out for it"""
+    for file_path in media.files.exclude(file_path__isnull=True).values_list('file_path', flat=True):
+        try:
+            if file_path != media.path and os.path.samefile(file_path, media.path):
+                os.unlink(file_path)
+        except OSError:
+            pass
+    media.files.update(file_path=None)
+    try:
+        os.unlink(media.path)
+        os.rmdir(Path(media.path).parent)
+    except OSError:
+        # Already gone, or other formats of the video are still in the directory
+        pass
+    media.delete()
+
+
+def enforce_quota():
+    """Evict the least recently used media until the store is under DOWNLOAD_STORE_MAX_BYTES"""
+    total = StoredMedia.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total <= settings.DOWNLOAD_STORE_MAX_BYTES:
+        return 0
+    evicted = 0
+    for media in StoredMedia.objects.order_by('last_used').iterator():
+        if total <= settings.DOWNLOAD_STORE_MAX_BYTES:
+            break
+        total -= media.size
+        evict(media)
+        evicted += 1
+    logger.info(f"Evicted {evicted} files from the download store")
+    return evicted
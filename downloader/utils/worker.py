@@ -0,0 +1,260 @@
+# utils/worker.py
+"""
+The download worker. It claims DownloadQueue rows one at a time and runs up
+to DOWNLOAD_WORKERS yt-dlp downloads side by side in a process pool, so
+downloads use every core instead of blocking a web request. Only this
+process writes to the database, the pool processes just download.
+Playlist URLs are flat-extracted and queued as one item per entry.
+"""
+import logging
+import multiprocessing
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from downloader.models import DownloadedFiles, DownloadQueue
+from downloader.utils import metadata, store, ytdlp
+
+logger = logging.getLogger(__name__)
+
+
+def download_options(item):
+    """yt-dlp options for a queued download"""
+    return {
+        'format': settings.DOWNLOAD_FORMAT,
+        # Files are written once into the store and linked into DOWNLOAD_ROOT afterwards
+        'outtmpl': store.store_template(),
+        'concurrent_fragment_downloads': item.concurrent_fragments or settings.DOWNLOAD_CONCURRENT_FRAGMENTS,
+        # A watch URL that also names a playlist downloads just the video
+        'noplaylist': True,
+        'quiet': True,
+        'noprogress': True,
+    }
+
+
+def recover_interrupted():
+    """Put downloads left running by a dead worker back in the queue"""
+    items = DownloadQueue.objects.filter(status=DownloadQueue.STATUS_RUNNING).update(
+        status=DownloadQueue.STATUS_PENDING
+    )
+    if items:
+        logger.info(f"Recovered {items} interrupted downloads")
+
+
+def claim_next_item():
+    """Atomically claim the oldest pending download. Returns None when the queue is empty."""
+    pending = DownloadQueue.objects.filter(status=DownloadQueue.STATUS_PENDING)
+    while True:
+        item = pending.order_by('created_at', 'id').first()
+        if item is None:
+            return None
+        claimed = DownloadQueue.objects.filter(id=item.id, status=DownloadQueue.STATUS_PENDING).update(
+            status=DownloadQueue.STATUS_RUNNING,
+            started_at=timezone.now(),
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return DownloadQueue.objects.get(id=item.id)
+        # Another worker got there first, try the next one
+
+
+def fit(model, field, value):
+    """value cut to the field's max_length, None for empty values"""
+    return (value or '')[:model._meta.get_field(field).max_length] or None
+
+
+def expand_playlist(item, result):
+    """Queue every entry of a playlist as its own item, so they download in parallel"""
+    playlist = fit(DownloadQueue, 'playlist', result['playlist'])
+    DownloadQueue.objects.bulk_create([
+        DownloadQueue(
+            user=item.user,
+            url=url,
+            parent=item,
+            playlist=playlist,
+            concurrent_fragments=item.concurrent_fragments,
+        )
+        for url in result['entries']
+    ])
+    item.playlist = playlist
+    item.save(update_fields=['playlist'])
+    logger.info(f"Expanded playlist {item.url} into {len(result['entries'])} downloads")
+
+
+def finish_item(item, result=None, error=None):
+    """Record the outcome of a download, putting failed ones back in the queue until they run out of attempts"""
+    if error is not None:
+        logger.warning(f"Download of {item.url} failed on attempt {item.attempts}: {error}")
+        if item.attempts >= settings.DOWNLOAD_MAX_ATTEMPTS:
+            item.status = DownloadQueue.STATUS_FAILED
+            item.finished_at = timezone.now()
+        else:
+            item.status = DownloadQueue.STATUS_PENDING
+        item.error = str(error)
+    elif 'entries' in result:
+        expand_playlist(item, result)
+        item.status = DownloadQueue.STATUS_DONE
+        item.error = None
+        item.finished_at = timezone.now()
+    else:
+        info = result['info']
+        media = store.add(info, result['file_path'], result['filename'])
+        item.downloaded_file = DownloadedFiles.objects.create(
+            user=item.user,
+            url=item.url,
+            title=fit(DownloadedFiles, 'title', info.get('title')),
+            author=fit(DownloadedFiles, 'author', info.get('uploader') or info.get('channel')),
+            author_url=fit(DownloadedFiles, 'author_url', info.get('uploader_url') or info.get('channel_url')) or '',
+            playlist=fit(DownloadedFiles, 'playlist', item.playlist or info.get('playlist_title') or info.get('playlist')),
+            file_path=store.link(media),
+            media=media,
+            metadata=metadata.save(item.url, info),
+        )
+        item.status = DownloadQueue.STATUS_DONE
+        item.error = None
+        item.finished_at = timezone.now()
+        item.downloaded_bytes = item.total_bytes = media.size
+        logger.info(f"Downloaded {item.url} to {media.path}")
+        store.enforce_quota()
+    item.speed = item.eta = None
+    item.save(update_fields=[
+        'status', 'error', 'downloaded_file', 'finished_at', 'downloaded_bytes', 'total_bytes', 'speed', 'eta',
+    ])
+    return error is None
+
+
+def settle(item, result=None, error=None):
+    """
+    finish_item for the worker loop. An outcome that can't be recorded (e.g.
+    the store can't link the file) fails the item for good instead of
+    stopping the worker with the item left running.
+    """
+    try:
+        return finish_item(item, result, error)
+    except Exception as e:
+        logger.exception(f"Could not record the download of {item.url}")
+        DownloadQueue.objects.filter(id=item.id).update(
+            status=DownloadQueue.STATUS_FAILED, error=str(e) or type(e).__name__,
+            finished_at=timezone.now(), speed=None, eta=None,
+        )
+        return False
+
+
+def finish_from_store(item):
+    """
+    Complete an item straight from the store when its video was downloaded
+    before. Returns False if it still has to be downloaded.
+    """
+    media = store.find(item.url)
+    source = media and media.files.order_by('-id').first()
+    if source is None:
+        return False
+    item.downloaded_file = DownloadedFiles.objects.create(
+        user=item.user,
+        url=item.url,
+        title=source.title,
+        author=source.author,
+        author_url=source.author_url,
+        playlist=item.playlist or source.playlist,
+        content=source.content,
+        file_path=store.link(media),
+        media=media,
+        metadata=source.metadata,
+    )
+    item.status = DownloadQueue.STATUS_DONE
+    item.error = None
+    item.finished_at = timezone.now()
+    # Nothing was transferred, so a reused file doesn't count towards throughput
+    item.save(update_fields=['status', 'error', 'downloaded_file', 'finished_at'])
+    logger.info(f"Reused stored {media} for {item.url}")
+    return True
+
+
+def make_pool(workers, progress_queue):
+    # Spawned rather than forked so children don't inherit the database connection
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=ytdlp.init_process,
+        initargs=(progress_queue,),
+    )
+
+
+def save_progress(progress_queue):
+    """Write the latest progress reported for each running item"""
+    latest = {}
+    while True:
+        try:
+            item_id, progress = progress_queue.get_nowait()
+        except queue.Empty:
+            break
+        latest[item_id] = progress
+    for item_id, progress in latest.items():
+        DownloadQueue.objects.filter(id=item_id, status=DownloadQueue.STATUS_RUNNING).update(**progress)
+
+
+def run_worker(workers=None, poll_interval=None, once=False):
+    """Main loop of the download worker started by the run_download_worker command"""
+    workers = workers or settings.DOWNLOAD_WORKERS
+    poll_interval = poll_interval or settings.DOWNLOAD_POLL_INTERVAL
+    recover_interrupted()
+
+    progress_queue = multiprocessing.get_context('spawn').Queue()
+    pool = make_pool(workers, progress_queue)
+    running = {}
+    try:
+        while True:
+            while len(running) < workers:
+                item = claim_next_item()
+                if item is None:
+                    break
+                try:
+                    if finish_from_store(item):
+                        continue
+                except Exception as e:
+                    # Download it again rather than failing on a broken store entry
+                    logger.exception(f"Could not reuse the stored file for {item.url}: {e}")
+                cached = metadata.lookup(item.url)
+                running[pool.submit(
+                    ytdlp.download, item.url, download_options(item), settings.DOWNLOAD_OUTTMPL,
+                    item_id=item.id, progress_interval=settings.DOWNLOAD_PROGRESS_INTERVAL,
+                    info=cached.info if cached else None,
+                )] = item
+
+            if not running:
+                if once:
+                    return
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(
+                running, timeout=min(poll_interval, settings.DOWNLOAD_PROGRESS_INTERVAL),
+                return_when=FIRST_COMPLETED,
+            )
+            save_progress(progress_queue)
+            broken = False
+            for future in done:
+                item = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # A pool process died (e.g. killed for memory), the pool can't be reused
+                    broken = True
+                    settle(item, error=e)
+                except Exception as e:
+                    settle(item, error=e)
+                else:
+                    settle(item, result)
+            if broken:
+                for future, item in running.items():
+                    settle(item, error=BrokenProcessPool("Download process pool restarted"))
+                running = {}
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = make_pool(workers, progress_queue)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
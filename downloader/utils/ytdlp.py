@@ -0,0 +1,104 @@
+# utils/ytdlp.py
+"""
+Runs inside the download worker's process pool. Nothing here imports Django
+so a freshly spawned process can load it without setting Django up.
+"""
+import os
+import time
+
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadError, ReExtractInfo
+
+# Set in each pool process by init_process, progress updates go back to the worker through it
+_progress_queue = None
+
+
+def init_process(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def progress_hook(item_id, interval):
+    """A yt-dlp progress hook that reports at most every interval seconds"""
+    last = 0
+
+    def hook(status):
+        nonlocal last
+        now = time.monotonic()
+        finished = status['status'] == 'finished'
+        if _progress_queue is None or (not finished and now - last < interval):
+            return
+        last = now
+        _progress_queue.put((item_id, {
+            'downloaded_bytes': status.get('downloaded_bytes') or 0,
+            'total_bytes': status.get('total_bytes') or status.get('total_bytes_estimate'),
+            'speed': status.get('speed'),
+            'eta': status.get('eta'),
+        }))
+
+    return hook
+
+
+class DownloadFailed(Exception):
+    """A yt-dlp error reduced to its message, yt-dlp's own exceptions can't be pickled back to the worker"""
+    pass
+
+
+def playlist_entries(info):
+    urls = []
+    for entry in info.get('entries') or []:
+        url = entry and (entry.get('webpage_url') or entry.get('url'))
+        if url:
+            urls.append(url)
+    return {
+        'playlist': info.get('title') or info.get('id'),
+        'entries': urls,
+    }
+
+
+def download(url, options, library_template=None, item_id=None, progress_interval=1.0, info=None):
+    """
+    Download url with yt-dlp and return the sanitized info dict, the path of
+    the file that was written and its name under library_template. Progress
+    of item_id is reported every progress_interval seconds.
+
+    A cached info dict skips extraction. If its format URLs no longer work
+    the URL is extracted again.
+
+    A playlist is not downloaded, it is flat-extracted and returned as
+    {'playlist': title, 'entries': [url, ...]} for the worker to queue.
+    """
+    # extract_flat keeps a playlist reached through a redirect from being downloaded entry by entry
+    options = dict(options, extract_flat='in_playlist')
+    if item_id is not None:
+        options['progress_hooks'] = [progress_hook(item_id, progress_interval)]
+    try:
+        with YoutubeDL(options) as ydl:
+            if info is not None:
+                try:
+                    info = ydl.process_ie_result(info, download=True)
+                except (DownloadError, ReExtractInfo) as e:
+                    ydl.report_warning(f"Cached info failed to download: {e}; extracting {url} again")
+                    info = None
+            if info is None:
+                # process=False stops after the extractor, so a playlist's entries are never resolved here
+                info = ydl.extract_info(url, download=False, process=False)
+                if info.get('_type') != 'playlist':
+                    info = ydl.process_ie_result(info, download=True)
+            if info.get('_type') == 'playlist':
+                return playlist_entries(info)
+            info = ydl.sanitize_info(info)
+            filename = ydl.prepare_filename(info, outtmpl=library_template) if library_template else None
+    except Exception as e:
+        raise DownloadFailed(str(e)) from None
+
+    downloads = info.get('requested_downloads') or [{}]
+    file_path = downloads[0].get('filepath') or info.get('filepath')
+    if filename:
+        # The template's extension is the selected format's, match the file actually written
+        filename = os.path.splitext(filename)[0] + os.path.splitext(file_path)[1]
+    return {
+        'info': info,
+        'file_path': file_path,
+        'filename': filename,
+    }
@@ -1,15 +1,18 @@
 import json
+import logging
 
-from django.shortcuts import render
-from django.http import HttpResponse, HttpResponseRedirect
-from yt_dlp import YoutubeDL
+from django.shortcuts import redirect, render
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from .models import *
 from .forms import *
+from .utils.stats import throughput
+
+logger = logging.getLogger(__name__)
 
 # Create your views here.
 
 def index(request):
-    queue = DownloadQueue.objects.all()
+    queue = DownloadQueue.objects.order_by('-created_at')[:50]
     form = SubmitUrl
 
     context = {
@@ -20,24 +23,48 @@ def index(request):
     return render(request, "downloader/index.html", context)
 
 
+def progress(request):
+    """Progress of queued downloads plus overall throughput, polled by the index page"""
+    items = DownloadQueue.objects.order_by('-created_at')[:50]
+    return JsonResponse({
+        'items': [item.progress() for item in items],
+        'active': any(item.is_active for item in items),
+        'throughput': throughput(),
+    })
+
+
 def download(request):
     if request.method == "POST":
         form = SubmitUrl(request.POST)
 
         if form.is_valid():
             URL = form.cleaned_data["url"]
-            print(URL)
-
-            info = YoutubeDL().extract_info(url=URL, download=False)
+            logger.info(f"Queued {URL} for {request.user.get_username()}")
 
-            print(json.dumps(YoutubeDL.sanitize_info(info)))
+            # The download worker picks it up, see downloader/utils/worker.py
+            DownloadQueue.objects.create(
+                user=request.user.get_username(),
+                url=URL,
+                concurrent_fragments=form.cleaned_data["concurrent_fragments"],
+            )
+            return redirect("downloader:home")
 
     return render(request, "downloader/download.html")
 
 
 def item(request, user, item_id):
-    item = DownloadedFiles.objects.get(id__exact=item_id)
-    return render(request, "downloader/item.html", context={"item": item})
+    item = DownloadedFiles.objects.select_related("metadata").get(id__exact=item_id)
+    # Read from the metadata cache instead of extracting the URL again
+    info = item.metadata.info if item.metadata else json.loads(item.content or "{}")
+    formats = [
+        f for f in info.get("formats") or []
+        if f.get("acodec") not in (None, "none") or f.get("vcodec") not in (None, "none")
+    ]
+    return render(request, "downloader/item.html", context={
+        "item": item,
+        "info": info,
+        "formats": formats,
+    })
 
 
 def completed(request):
@@ -23,6 +23,33 @@ class SongAdmin(admin.ModelAdmin):
 
 admin.site.register(Song, SongAdmin)
 
+class UserRatingAdmin(admin.ModelAdmin):
+    list_display = ['user', 'content_type', 'content_object', 'rating', 'last_updated']
+
+    def get_queryset(self, request):
+        # with_content_objects() selects content_type, which stops the changelist applying list_select_related
+        return super().get_queryset(request).with_content_objects().select_related('user')
+
+admin.site.register(UserRating, UserRatingAdmin)
+
+class UserFavoriteAdmin(admin.ModelAdmin):
+    list_display = ['user', 'content_type', 'content_object', 'date_favorited']
+
+    def get_queryset(self, request):
+        # with_content_objects() selects content_type, which stops the changelist applying list_select_related
+        return super().get_queryset(request).with_content_objects().select_related('user')
+
+admin.site.register(UserFavorite, UserFavoriteAdmin)
+
+class RatingSummaryAdmin(admin.ModelAdmin):
+    list_display = ['content_type', 'object_id', 'rating_count', 'average', 'last_updated']
+    list_filter = ['content_type']
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_content_objects()
+
+admin.site.register(RatingSummary, RatingSummaryAdmin)
+
 # Register your models here.
-admin.site.register([YtmusicAuth, AlbumSong, UserFavorite, UserRating])
+admin.site.register([YtmusicAuth, AlbumSong, SyncJob, SyncTask])
 
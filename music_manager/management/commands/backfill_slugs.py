@@ -0,0 +1,64 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music_manager.models import Album, Artist, slug_base, unique_slug
+
+
+class Command(BaseCommand):
+    help = (
+        "Give every artist a unique slug and every album a slug unique among its artists' albums. "
+        "Run it before migrating to the unique Artist.slug constraint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help="Rows written per bulk update",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            artists = self.backfill_artists(batch_size)
+            albums = self.backfill_albums(batch_size)
+        self.stdout.write(f"Updated {artists} artist and {albums} album slugs")
+
+    def backfill_artists(self, batch_size):
+        # The oldest row keeps a contested slug, so existing links keep working for it.
+        # Only the columns the command needs are read, so this also works on a
+        # database that is still behind the current models.
+        taken = set()
+        changed = []
+        for artist_id, name, channel_id, slug in Artist.objects.order_by('id').values_list(
+            'id', 'name', 'channelId', 'slug',
+        ).iterator(chunk_size=batch_size):
+            if not slug or slug in taken:
+                slug = unique_slug(slug_base(name, channel_id), taken)
+                changed.append(Artist(id=artist_id, slug=slug))
+            taken.add(slug)
+        Artist.objects.bulk_update(changed, ['slug'], batch_size=batch_size)
+        return len(changed)
+
+    def backfill_albums(self, batch_size):
+        album_artists = defaultdict(list)
+        for album_id, artist_id in Album.artists.through.objects.values_list('album_id', 'artist_id'):
+            album_artists[album_id].append(artist_id)
+
+        taken = defaultdict(set)  # artist id -> slugs of that artist's albums
+        changed = []
+        for album_id, title, browse_id, slug in Album.objects.order_by('id').values_list(
+            'id', 'title', 'browseId', 'slug',
+        ).iterator(chunk_size=batch_size):
+            artist_ids = album_artists.get(album_id, [])
+            if not slug or any(slug in taken[artist_id] for artist_id in artist_ids):
+                used = set().union(*(taken[artist_id] for artist_id in artist_ids))
+                slug = unique_slug(slug_base(title, browse_id), used)
+                changed.append(Album(id=album_id, slug=slug))
+            for artist_id in artist_ids:
+                taken[artist_id].add(slug)
+        Album.objects.bulk_update(changed, ['slug'], batch_size=batch_size)
+        return len(changed)
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from music_manager.utils.library_io import export_records, open_jsonl, write_records
+
+
+class Command(BaseCommand):
+    help = "Stream the artist/album/song catalog and users' ratings and favorites to a JSON Lines file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, compressed if it ends in .gz, '-' for stdout")
+        parser.add_argument(
+            '--no-user-data',
+            action='store_false',
+            dest='user_data',
+            help="Only export the catalog, without ratings and favorites",
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help="Rows read per query",
+        )
+
+    def handle(self, *args, **options):
+        with open_jsonl(options['path'], 'w') as stream:
+            count = write_records(export_records(options['user_data'], options['batch_size']), stream)
+        if options['path'] != '-':
+            self.stdout.write(f"Exported {count} records")
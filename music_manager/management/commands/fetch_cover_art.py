@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from music_manager.utils import covers
+
+
+class Command(BaseCommand):
+    help = "Download missing album covers and artist images and make their thumbnails"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help="Albums and artists handled per batch (defaults to all of them at once)",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            total += covers.fetch_missing(limit=options['limit'])
+            # Failed URLs wait for their retry time, so every batch leaves fewer pending
+            if options['limit'] is None or not covers.pending(limit=1):
+                break
+        self.stdout.write(f"Stored {total} images")
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from music_manager.utils.library_io import LibraryImporter, open_jsonl, read_records
+
+
+class Command(BaseCommand):
+    help = "Load a library written by export_library, skipping rows that already exist"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File from export_library, .gz is decompressed, '-' reads stdin")
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help="Records written per bulk insert",
+        )
+
+    def handle(self, *args, **options):
+        importer = LibraryImporter(batch_size=options['batch_size'])
+        try:
+            with open_jsonl(options['path'], 'r') as stream:
+                importer.run(read_records(stream))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Import failed: {e}")
+        for record_type, count in (+importer.created).items():
+            self.stdout.write(f"Created {count} {record_type} records")
+        for record_type, count in (+importer.skipped).items():
+            self.stdout.write(f"Skipped {count} {record_type} records that already exist or don't match anything here")
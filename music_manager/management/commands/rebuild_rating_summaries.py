@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from music_manager.models import RatingSummary
+
+
+class Command(BaseCommand):
+    help = "Recompute every RatingSummary from the UserRating table (after bulk imports or the initial deploy)"
+
+    def handle(self, *args, **options):
+        count = RatingSummary.rebuild()
+        self.stdout.write(f"Rebuilt {count} rating summaries")
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from music_manager.utils import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of artists, albums and songs"
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write(f"Indexed {count} artists, albums and songs")
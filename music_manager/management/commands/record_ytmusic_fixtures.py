@@ -0,0 +1,37 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from music_manager.models import YTMusicAuthError
+from music_manager.utils.benchmark import RECORDING_PATH, record
+from music_manager.utils.ytmusic import get_user_ytmusic_client
+
+
+class Command(BaseCommand):
+    help = "Record a user's YouTube Music responses as the fixtures replayed by run_benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="User whose YouTube Music account is recorded")
+        parser.add_argument('--artists', type=int, default=5, help="How many of their subscriptions to record")
+        parser.add_argument('--songs-per-album', type=int, default=1, help="get_song responses recorded per album")
+        parser.add_argument('--output', default=str(RECORDING_PATH), help="Where to write the recording")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['username']}")
+
+        try:
+            # Fresh responses, not whatever the response cache holds
+            client = get_user_ytmusic_client(user, refresh=True)
+        except YTMusicAuthError as e:
+            raise CommandError(str(e))
+        recording = record(client, options['artists'], options['songs_per_album'])
+        with open(options['output'], 'w', encoding='utf-8') as f:
+            json.dump(recording, f, separators=(',', ':'))
+        self.stdout.write(
+            f"Recorded {len(recording['get_artist'])} artists, {len(recording['get_album'])} albums "
+            f"and {len(recording['get_song'])} songs to {options['output']}"
+        )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from music_manager.models import SyncJob, YtmusicAuth
+
+
+class Command(BaseCommand):
+    help = "Queue an incremental library sync for every user with YouTube Music auth (run nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--albums',
+            action='store_true',
+            help="Also re-check album track lists older than SYNC_ALBUM_REFRESH_AGE",
+        )
+
+    def handle(self, *args, **options):
+        kinds = [SyncJob.KIND_LIBRARY]
+        if options['albums']:
+            kinds.append(SyncJob.KIND_ALBUMS)
+
+        queued = 0
+        for auth in YtmusicAuth.objects.select_related('user'):
+            for kind in kinds:
+                SyncJob.enqueue(auth.user, kind)
+                queued += 1
+        self.stdout.write(f"Queued {queued} sync jobs")
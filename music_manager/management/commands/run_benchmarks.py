@@ -0,0 +1,41 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from music_manager.utils.benchmark import load_recording, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark full and incremental library syncs and the library pages against recorded "
+        "YouTube Music responses, in a throwaway test database. Prints the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--artists', type=int, default=50, help="Subscribed artists, recorded ones are cloned to reach it")
+        parser.add_argument('--latency', type=float, default=0, help="Milliseconds added to every API call")
+        parser.add_argument('--jitter', type=float, default=0, help="Up to this many more milliseconds, at random")
+        parser.add_argument(
+            '--new-releases',
+            type=float,
+            default=0.1,
+            help="Share of artists with a new album in the incremental sync",
+        )
+        parser.add_argument('--repeat', type=int, default=5, help="Requests per page benchmark")
+        parser.add_argument('--recording', help="Recording to replay instead of the bundled one")
+        parser.add_argument('--output', help="Also write the results to this file")
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            artists=options['artists'],
+            latency=options['latency'] / 1000,
+            jitter=options['jitter'] / 1000,
+            new_releases=options['new_releases'],
+            repeat=options['repeat'],
+            recording=load_recording(options['recording']) if options['recording'] else None,
+        )
+        text = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(text + '\n')
+        self.stdout.write(text)
@@ -0,0 +1,50 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from music_manager.utils.sync import run_worker
+
+
+class Command(BaseCommand):
+    help = "Process queued YouTube Music sync jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help="Exit once the queue is empty instead of polling for new jobs",
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=None,
+            help="Seconds to wait between queue checks (defaults to SYNC_POLL_INTERVAL)",
+        )
+        parser.add_argument(
+            '--async',
+            action='store_true',
+            dest='use_async',
+            help="Run several jobs at once on an asyncio event loop",
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help="Jobs run at once with --async (defaults to SYNC_ASYNC_JOBS)",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Sync worker started")
+        try:
+            if options['use_async']:
+                from music_manager.utils.async_sync import run_worker_async
+
+                asyncio.run(run_worker_async(
+                    poll_interval=options['poll_interval'],
+                    once=options['once'],
+                    concurrency=options['concurrency'],
+                ))
+            else:
+                run_worker(poll_interval=options['poll_interval'], once=options['once'])
+        except KeyboardInterrupt:
+            self.stdout.write("Sync worker stopped")
@@ -1,15 +1,21 @@
 import ytmusicapi
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.prefetch import GenericPrefetch
 from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db.models import CASCADE
 from django.conf import settings
+from django.utils import timezone
 from django.utils.text import slugify
 from ytmusicapi import YTMusic, OAuthCredentials
+import hashlib
+import json
 import os
 import logging
-import time
+
+from .utils.pipeline import batched, fetch_concurrently
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +37,60 @@ def user_auth_upload_path(instance, filename):
         raise  # Re-raise the exception after logging
 
 
+SLUG_MAX_LENGTH = 50
+
+
+def cover_art_storage():
+    """Covers and artist images live under COVER_ART_ROOT, named by content hash (see utils/covers.py)"""
+    return FileSystemStorage(location=settings.COVER_ART_ROOT)
+
+
+def largest_thumbnail(thumbnails):
+    """URL of the widest image in a ytmusicapi 'thumbnails' list"""
+    if not thumbnails:
+        return None
+    return max(thumbnails, key=lambda thumbnail: thumbnail.get('width') or 0)['url']
+
+
+def slug_base(text, fallback):
+    """
+    slugify(text), or slugify(fallback) for names with nothing to keep
+    (e.g. non-Latin titles), short enough for a numeric suffix to fit
+    """
+    base = slugify(text or '') or slugify(fallback or '')
+    return base[:SLUG_MAX_LENGTH - 5].rstrip('-')
+
+
+def free_slug(queryset, base, taken=()):
+    """
+    First of base, base-2, base-3... that no row of queryset has (one
+    indexed lookup each) and that isn't in taken
+    """
+    slug = base
+    suffix = 2
+    while slug in taken or queryset.filter(slug=slug).exists():
+        slug = f'{base}-{suffix}'
+        suffix += 1
+    return slug
+
+
+def unique_slug(base, taken):
+    """base, or the first of base-2, base-3, ... that isn't in taken"""
+    slug = base
+    suffix = 2
+    while slug in taken:
+        slug = f'{base}-{suffix}'
+        suffix += 1
+    return slug
+
+
+def content_digest(field_file):
+    """The hash a stored cover is named by, or None if it hasn't been fetched"""
+    if not field_file:
+        return None
+    return os.path.splitext(os.path.basename(field_file.name))[0]
+
+
 # Create your models here.
 class YtmusicAuth(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='ytmusic_auth')
@@ -86,14 +146,14 @@ class YtmusicAuth(models.Model):
 
             raise  # Re-raise the exception after cleanup
 
-    def get_ytmusic_client(self):
+    def get_ytmusic_client(self, requests_session=None):
         """
         Returns an authenticated YTMusic instance using the stored OAuth file
         """
         try:
             # Get the full filesystem path to the auth file
             auth_path = self.auth_file.path
-            return YTMusic(auth_path, oauth_credentials=OAuthCredentials(settings.YTMUSIC_CLIENT_ID,settings.YTMUSIC_CLIENT_SECRET))
+            return YTMusic(auth_path, requests_session=requests_session, oauth_credentials=OAuthCredentials(settings.YTMUSIC_CLIENT_ID,settings.YTMUSIC_CLIENT_SECRET))
         except Exception as e:
             # Handle cases where the file might be missing or corrupted
             raise YTMusicAuthError(f"Failed to initialize YTMusic client: {str(e)}")
@@ -102,6 +162,171 @@ class YTMusicAuthError(Exception):
     """Custom exception for YTMusic auth related errors"""
     pass
 
+class SyncJob(models.Model):
+    """A queued YouTube Music sync for one user, processed by the sync worker"""
+    KIND_LIBRARY = 'library'
+    KIND_ALBUMS = 'albums'
+    KIND_ALBUM = 'album'
+    KINDS = [
+        (KIND_LIBRARY, 'Library subscriptions'),
+        (KIND_ALBUMS, 'Album track lists'),
+        (KIND_ALBUM, 'Requested albums'),
+    ]
+    # Jobs started by someone waiting on a page, run ahead of everything else
+    PRIORITY_KINDS = (KIND_ALBUM,)
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_jobs')
+    kind = models.CharField(max_length=16, choices=KINDS, default=KIND_LIBRARY)
+    status = models.CharField(max_length=16, choices=STATUSES, default=STATUS_PENDING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # Backstop for enqueue(): at most one pending or running job per user and kind
+            models.UniqueConstraint(
+                fields=['user', 'kind'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='one_active_sync_job_per_kind',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} sync for {self.user.username} ({self.status})"
+
+    @classmethod
+    def enqueue(cls, user, kind=KIND_LIBRARY):
+        """
+        Return the user's active job of this kind. A job that failed part way is
+        resumed from its unfinished tasks, otherwise a new one is created.
+        """
+        with transaction.atomic():
+            # Two tabs, or a page and refresh_library, can enqueue at once. Locking the
+            # user's row serializes them where the database has row locks, the
+            # constraint in Meta catches the rest (SQLite).
+            User.objects.select_for_update().filter(pk=user.pk).exists()
+            job = cls.objects.filter(user=user, kind=kind).first()
+            if job is not None and job.is_active:
+                return job
+            if job is not None and job.status == cls.STATUS_FAILED:
+                job.tasks.exclude(status=SyncTask.STATUS_DONE).update(
+                    status=SyncTask.STATUS_PENDING, attempts=0
+                )
+                job.status = cls.STATUS_PENDING
+                job.error = None
+                job.finished_at = None
+                job.save()
+                return job
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(user=user, kind=kind)
+            except IntegrityError:
+                return cls.objects.get(user=user, kind=kind, status__in=cls.ACTIVE_STATUSES)
+
+    @classmethod
+    def enqueue_album(cls, user, album):
+        """Queue the track list of a single album for the sync worker"""
+        job = cls.enqueue(user, cls.KIND_ALBUM)
+        SyncTask.objects.get_or_create(
+            job=job, kind=SyncTask.KIND_ALBUM, target_id=album.browseId,
+            defaults={'name': album.title},
+        )
+        return job
+
+    @property
+    def is_active(self):
+        return self.status in self.ACTIVE_STATUSES
+
+    def progress(self):
+        """Summary of task counts used by the progress endpoint"""
+        counts = dict(self.tasks.values_list('status').annotate(models.Count('id')))
+        total = sum(counts.values())
+        finished = counts.get(SyncTask.STATUS_DONE, 0) + counts.get(SyncTask.STATUS_FAILED, 0)
+        current = self.tasks.filter(status=SyncTask.STATUS_RUNNING).values_list('name', flat=True).first()
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': total,
+            'completed': counts.get(SyncTask.STATUS_DONE, 0),
+            'failed': counts.get(SyncTask.STATUS_FAILED, 0),
+            'progress': int(finished * 100 / total) if total else 0,
+            'current': current,
+            'error': self.error,
+        }
+
+
+class SyncTask(models.Model):
+    """A single artist or album to sync as part of a SyncJob"""
+    KIND_ARTIST = 'artist'
+    KIND_ALBUM = 'album'
+    KINDS = [
+        (KIND_ARTIST, 'Artist'),
+        (KIND_ALBUM, 'Album'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUSES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    job = models.ForeignKey(SyncJob, on_delete=models.CASCADE, related_name='tasks')
+    kind = models.CharField(max_length=16, choices=KINDS)
+    target_id = models.CharField(max_length=255)  # channel/browse id passed to ytmusicapi
+    name = models.CharField(max_length=255, blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['id']
+        unique_together = ('job', 'kind', 'target_id')
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.name or self.target_id} ({self.status})"
+
+
+class UserContentQuerySet(models.QuerySet):
+    """Shared by UserRating, UserFavorite and RatingSummary, which point at artists, albums or songs"""
+
+    def with_content_objects(self):
+        """
+        Resolve content_object for every row with one id__in query per content
+        type instead of one query per row, and prefetch the relations the
+        templates show next to each object
+        """
+        return self.select_related('content_type').prefetch_related(
+            GenericPrefetch('content_object', [
+                Artist.objects.all(),
+                Album.objects.prefetch_related('artists'),
+                Song.objects.prefetch_related('primary_artists'),
+            ])
+        )
+
+
 # join tables from users
 class UserRating(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -119,8 +344,19 @@ class UserRating(models.Model):
     date_rated = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
 
+    objects = UserContentQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'content_type', 'object_id')
+        indexes = [
+            # The unique index plus rating: manage_artists' user_rating subquery reads
+            # only the rating, so it is answered from this index without the table
+            models.Index(fields=['user', 'content_type', 'object_id', 'rating']),
+            # top_rated (home, manage_likes)
+            models.Index(fields=['user', 'content_type', 'rating']),
+            # Used to recompute an object's RatingSummary
+            models.Index(fields=['content_type', 'object_id', 'rating']),
+        ]
         verbose_name = "User Rating"
         verbose_name_plural = "User Ratings"
 
@@ -138,8 +374,14 @@ class UserFavorite(models.Model):
 
     date_favorited = models.DateTimeField(auto_now_add=True)
 
+    objects = UserContentQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'content_type', 'object_id')
+        indexes = [
+            # Lookups by (user, content_type, object_id) use the unique_together index
+            models.Index(fields=['user', 'date_favorited']),
+        ]
         verbose_name = "User Favorite"
         verbose_name_plural = "User Favorites"
 
@@ -147,13 +389,86 @@ class UserFavorite(models.Model):
         return f"{self.user.username}'s favorite: {self.content_object}"
 
 
+class RatingSummary(models.Model):
+    """
+    Rating count and average of an artist, album or song over all users.
+    Kept up to date by the UserRating signals so reading an average is a
+    single row lookup instead of an aggregate over every rating. It is what
+    the average_rating property and the admin read. The per-user pages
+    (home, manage_likes, manage_artists) show the user's own ratings and
+    read UserRating directly, through top_rated and the manage_artists
+    subqueries.
+    """
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_total = models.IntegerField(default=0)
+    average = models.FloatField(default=0)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    objects = UserContentQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+        indexes = [
+            models.Index(fields=['content_type', 'average']),
+        ]
+        verbose_name = "Rating Summary"
+        verbose_name_plural = "Rating Summaries"
+
+    def __str__(self):
+        return f"{self.content_object}: {self.average:.1f} from {self.rating_count} ratings"
+
+    @classmethod
+    def refresh(cls, content_type_id, object_id):
+        """Recompute one object's summary from its ratings, removing it once none are left"""
+        totals = UserRating.objects.filter(
+            content_type_id=content_type_id, object_id=object_id
+        ).aggregate(count=models.Count('rating'), total=models.Sum('rating'))
+        if not totals['count']:
+            cls.objects.filter(content_type_id=content_type_id, object_id=object_id).delete()
+            return None
+        summary, _ = cls.objects.update_or_create(
+            content_type_id=content_type_id, object_id=object_id,
+            defaults={
+                'rating_count': totals['count'],
+                'rating_total': totals['total'],
+                'average': totals['total'] / totals['count'],
+            },
+        )
+        return summary
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every summary, for ratings written without signals (bulk_create, update)"""
+        rows = UserRating.objects.values('content_type_id', 'object_id').annotate(
+            count=models.Count('rating'), total=models.Sum('rating')
+        ).order_by()
+        with transaction.atomic():
+            cls.objects.all().delete()
+            for batch in batched(rows, 500):
+                cls.objects.bulk_create([
+                    cls(
+                        content_type_id=row['content_type_id'],
+                        object_id=row['object_id'],
+                        rating_count=row['count'],
+                        rating_total=row['total'],
+                        average=row['total'] / row['count'],
+                    )
+                    for row in batch
+                ])
+        return cls.objects.count()
+
+
 
 
 # -------------------------------
 
 class Artist(models.Model):
     name = models.CharField(max_length=255)
-    slug = models.SlugField(null=True)
+    slug = models.SlugField(max_length=SLUG_MAX_LENGTH, unique=True, null=True)
     channelId = models.CharField(max_length=255, unique=True,)
     album_browseId = models.CharField(max_length=255, default='None', null=True)
     album_params = models.CharField(max_length=255, default='None', null=True)
@@ -162,21 +477,36 @@ class Artist(models.Model):
     singles_params = models.CharField(max_length=255, default='None', null=True)
     number_of_singles = models.PositiveIntegerField(blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
+    thumbnail_url = models.URLField(max_length=1000, blank=True, null=True)
+    image = models.ImageField(upload_to='artist_images/', storage=cover_art_storage, blank=True, null=True)
+    # Failed fetches of thumbnail_url, the cover art pipeline waits until thumbnail_retry_at to try again
+    thumbnail_failures = models.PositiveSmallIntegerField(default=0)
+    thumbnail_retry_at = models.DateTimeField(blank=True, null=True)
     need_discography = models.BooleanField(default=True)
+    fingerprint = models.CharField(max_length=40, blank=True, null=True)
+    last_synced = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Sort key of the paginated artist listings
+            models.Index(fields=['name', 'id']),
+        ]
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        if not self.slug:
-            self.slug = slugify(self.name)
+        base = slug_base(self.name, self.channelId)
+        # A slug made from the channel id before the name was known is replaced once it is
+        if not self.slug or (self.slug == slug_base('', self.channelId) and base != self.slug):
+            self.slug = free_slug(Artist.objects.exclude(pk=self.pk), base)
         super().save(*args, **kwargs)
 
     def populate(self, artist_info):
         self.name = artist_info['name']
         self.channelId = artist_info['channelId']
         self.bio = artist_info['description']
+        self.set_thumbnail(artist_info.get('thumbnails'))
         if 'albums' in artist_info and artist_info['albums']['browseId'] is not None:
             self.album_browseId = artist_info['albums']['browseId']
             if 'params' in artist_info['albums']:
@@ -194,54 +524,99 @@ class Artist(models.Model):
         else:
             self.singles_browseId = 'None'
 
-    def get_discography(self, ytmusic_client):
+    def set_thumbnail(self, thumbnails):
+        url = largest_thumbnail(thumbnails)
+        if url != self.thumbnail_url:
+            # Fetched again by the cover art pipeline
+            self.thumbnail_url = url
+            self.image = None
+            self.thumbnail_failures = 0
+            self.thumbnail_retry_at = None
+
+    @property
+    def cover_digest(self):
+        return content_digest(self.image)
+
+    @staticmethod
+    def discography_fingerprint(artist_info):
+        """
+        Hash of the releases listed in a get_artist response. A new or removed
+        release changes it, so an unchanged artist needs no further API calls.
+        """
+        releases = []
+        for section in ('albums', 'singles'):
+            if section in artist_info:
+                releases.append(artist_info[section].get('browseId'))
+                releases.extend(sorted(album['browseId'] for album in artist_info[section]['results']))
+        return hashlib.sha1(json.dumps(releases).encode()).hexdigest()
+
+    def sync(self, artist_info, ytmusic_client):
+        """
+        Bring the artist up to date with a get_artist response, only fetching
+        the discography when its fingerprint changed since the last sync
+        """
+        from .utils.ingest import finish_artist_sync, start_artist_sync
+
+        fingerprint = start_artist_sync(self, artist_info)
+        if fingerprint is not None:
+            self.get_discography(ytmusic_client, artist_info)
+        finish_artist_sync(self, fingerprint)
+        return fingerprint is not None
+
+    def get_discography(self, ytmusic_client, artist_info=None):
         albums = []
         if self.album_params != 'None':
             albums.extend(ytmusic_client.get_artist_albums(self.album_browseId, self.album_params))
         else:
-            artist_info = ytmusic_client.get_artist(self.channelId)
+            artist_info = artist_info or ytmusic_client.get_artist(self.channelId)
             if 'albums' in artist_info:
                 albums.extend(artist_info['albums']['results'])
         if self.singles_params != 'None':
             albums.extend(ytmusic_client.get_artist_albums(self.singles_browseId, self.singles_params))
         else:
-            artist_info = ytmusic_client.get_artist(self.channelId)
+            artist_info = artist_info or ytmusic_client.get_artist(self.channelId)
             if 'singles' in artist_info:
                 albums.extend(artist_info['singles']['results'])
 
-        if self.need_discography:
-            self.make_albums(albums, ytmusic_client)
-            self.need_discography = False
-            self.save()
+        # Albums already stored are only linked, new ones are fetched
+        self.make_albums(albums, ytmusic_client)
+        self.need_discography = False
+        self.save()
         return albums
 
 
     def make_albums(self, albums, ytmusic_client):
-        for album in albums:
-            new_album, created = Album.objects.get_or_create(browseId=album['browseId'])
-            print('\t album :', new_album.title, 'new :', created)
-            if created:
-                album_info = ytmusic_client.get_album(album['browseId'])
-                new_album.populate(album_info)
-                new_album.save()
-                new_album.artists.add(self)
-                new_album.save()
-            time.sleep(4)
+        from .utils.ingest import ingest_albums, link_known_albums
+
+        new_ids = link_known_albums(self, albums)
+
+        # get_album calls run on the fetch pool, this thread writes the results
+        results = fetch_concurrently(ytmusic_client.get_album, new_ids)
+        for batch in batched(results):
+            created = ingest_albums(self, batch)
+            logger.info(f"Artist {self.name}: {created} new albums")
 
 
 
 class Album(models.Model):
     title = models.CharField(max_length=255)
-    slug = models.SlugField(null=True)
+    # Unique among each artist's albums, see ensure_unique_slug
+    slug = models.SlugField(max_length=SLUG_MAX_LENGTH, null=True)
     artists = models.ManyToManyField(Artist, related_name='albums')
     release_year = models.PositiveIntegerField(blank=True, null=True)
     number_of_songs = models.PositiveIntegerField(blank=True, null=True)
     isExplicit = models.BooleanField(default=False)
     browseId = models.CharField(max_length=255, default='None')
-    cover_art = models.ImageField(upload_to='album_covers/', blank=True, null=True)
+    thumbnail_url = models.URLField(max_length=1000, blank=True, null=True)
+    cover_art = models.ImageField(upload_to='album_covers/', storage=cover_art_storage, blank=True, null=True)
+    # See Artist.thumbnail_failures
+    thumbnail_failures = models.PositiveSmallIntegerField(default=0)
+    thumbnail_retry_at = models.DateTimeField(blank=True, null=True)
     label = models.CharField(max_length=255, blank=True, null=True)
     catalog_number = models.CharField(max_length=50, blank=True, null=True)
     need_tracks = models.BooleanField(default=True)
+    fingerprint = models.CharField(max_length=40, blank=True, null=True)
+    last_synced = models.DateTimeField(blank=True, null=True)
 
     # For album types (standard, deluxe, re-release, etc.)
     ALBUM_TYPES = [
@@ -260,43 +635,73 @@ class Album(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.title)
+            # A new album has no artists yet, ensure_unique_slug runs again when they are added
+            base = slug_base(self.title, self.browseId)
+            self.slug = free_slug(self.artists_albums(), base) if self.pk else base
         super().save(*args, **kwargs)
 
+    @staticmethod
+    def album_slugs_taken(artists):
+        """Slugs of the artists' albums, for bulk inserts of albums of theirs"""
+        return Album.objects.filter(artists__in=artists).values_list('slug', flat=True)
+
+    def artists_albums(self):
+        """The other albums of this album's artists"""
+        return Album.objects.filter(artists__in=self.artists.all()).exclude(pk=self.pk)
+
+    def ensure_unique_slug(self):
+        """Give the album a new slug if another album of its artists has this one"""
+        if self.artists_albums().filter(slug=self.slug).exists():
+            self.slug = free_slug(self.artists_albums(), slug_base(self.title, self.browseId))
+            Album.objects.filter(pk=self.pk).update(slug=self.slug)
+
     def populate(self, album_info):
         self.title = album_info['title']
         self.album_type = album_info['type']
         self.release_year = album_info['year']
         self.number_of_songs = album_info['trackCount']
         self.isExplicit = album_info['isExplicit']
+        self.set_thumbnail(album_info.get('thumbnails'))
+
+    def set_thumbnail(self, thumbnails):
+        url = largest_thumbnail(thumbnails)
+        if url != self.thumbnail_url:
+            # Fetched again by the cover art pipeline
+            self.thumbnail_url = url
+            self.cover_art = None
+            self.thumbnail_failures = 0
+            self.thumbnail_retry_at = None
+
+    @property
+    def cover_digest(self):
+        return content_digest(self.cover_art)
+
+    @staticmethod
+    def tracks_fingerprint(tracks):
+        """Hash of an album's track list, changes when tracks are added or removed"""
+        return hashlib.sha1(json.dumps([track.get('videoId') for track in tracks]).encode()).hexdigest()
 
     def get_tracks(self, ytmusic_client):
-        print(self.need_tracks)
         if self.need_tracks:
-            tracks = ytmusic_client.get_album(self.browseId)['tracks']
-            self.make_tracks(tracks, ytmusic_client)
-            self.need_tracks=False
-            self.save()
-            print(self.need_tracks)
-            return tracks
+            return self.refresh_tracks(ytmusic_client)
         return None
 
-    def make_tracks(self, tracks, ytmusic_client):
-        for track in tracks:
-            print(track)
-            if track['videoId'] != 'None':
-                new_track, created = Song.objects.get_or_create(videoId=track['videoId'])
-                print(created)
-                if created:
-                    track_info = ytmusic_client.get_song(track['videoId'])
-                    print(track_info)
-                    new_track.populate(track_info)
-                    new_track.save()
-                    new_track.albums.add(self)
-                    new_track.primary_artists.set(self.artists.all())
-                    new_track.save()
-                print('song :',new_track.title,created)
-            time.sleep(4)
+    def refresh_tracks(self, ytmusic_client):
+        """Re-read the album, updating its cover and its tracks if the track list changed"""
+        from .utils.ingest import refresh_album
+
+        return refresh_album(self, ytmusic_client.get_album(self.browseId))
+
+    def make_tracks(self, tracks):
+        """
+        Create songs straight from the get_album track list and drop the
+        album's links to tracks it no longer lists. What only get_song has
+        (e.g. Song.url) is filled in by Song.get_details when it is needed.
+        """
+        from .utils.ingest import ingest_tracks
+
+        created = ingest_tracks(self, tracks, replace=True)
+        logger.info(f"Album {self.title}: {created} new songs")
 
 
 
@@ -323,8 +728,21 @@ class Song(models.Model):
             self.slug = slugify(self.title)
         super().save(*args, **kwargs)
 
+    def populate_from_track(self, track):
+        """Fill in what the get_album track list already tells us about the song"""
+        self.title = track['title']
+        self.slug = slugify(self.title)
+        self.videoId = track['videoId']
+        self.duration = track.get('duration_seconds')
+
+    def get_details(self, ytmusic_client):
+        """Fetch the get_song payload, only for songs created from an album track list"""
+        if self.url is None:
+            self.populate(ytmusic_client.get_song(self.videoId))
+            self.save()
+        return self
+
     def populate(self, song_info):
-        print(song_info)
         song_details = song_info['videoDetails']
         self.title = song_details['title']
         self.slug = slugify(self.title)
@@ -332,6 +750,7 @@ class Song(models.Model):
         self.url = song_info['microformat']['microformatDataRenderer']['urlCanonical']
         self.duration = song_details['lengthSeconds']
 
+
 # Intermediate model for Album-Song relationship to track additional data
 class AlbumSong(models.Model):
     album = models.ForeignKey(Album, on_delete=models.CASCADE)
@@ -354,15 +773,13 @@ def add_to_artist_class(cls):
     @property
     def average_rating(self):
         from django.contrib.contenttypes.models import ContentType
-        from .models import UserRating
+        from .models import RatingSummary
         ct = ContentType.objects.get_for_model(self)
-        ratings = UserRating.objects.filter(content_type=ct, object_id=self.id)
-        if ratings.exists():
-            return ratings.aggregate(models.Avg('rating'))['rating__avg']
-        return None
+        return RatingSummary.objects.filter(
+            content_type=ct, object_id=self.id
+        ).values_list('average', flat=True).first()
 
-    @property
-    def is_favorite(self, user):
+    def is_favorited_by(self, user):
         if not user.is_authenticated:
             return False
         from django.contrib.contenttypes.models import ContentType
@@ -375,7 +792,7 @@ def add_to_artist_class(cls):
         ).exists()
 
     cls.average_rating = average_rating
-    cls.is_favorite = is_favorite
+    cls.is_favorited_by = is_favorited_by
     return cls
 
 
@@ -0,0 +1,37 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Album, Artist, RatingSummary, Song, UserRating
+from .utils import search
+
+
+@receiver(post_save, sender=UserRating)
+@receiver(post_delete, sender=UserRating)
+def update_rating_summary(sender, instance, **kwargs):
+    """Keep the rated object's RatingSummary in step with its ratings"""
+    RatingSummary.refresh(instance.content_type_id, instance.object_id)
+
+
+@receiver(post_save, sender=Artist)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Song)
+def index_for_search(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_objects([instance])
+
+
+@receiver(post_delete, sender=Artist)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Song)
+def remove_from_search(sender, instance, **kwargs):
+    search.remove_object(instance)
+
+
+@receiver(m2m_changed, sender=Album.artists.through)
+def keep_album_slugs_unique(sender, instance, action, reverse, pk_set, **kwargs):
+    """Album.save can't check a new album's slug against its artists' albums before they are linked"""
+    if action != 'post_add':
+        return
+    albums = Album.objects.filter(pk__in=pk_set) if reverse else [instance]
+    for album in albums:
+        album.ensure_unique_slug()
@@ -1,3 +1,293 @@
-from django.test import TestCase
+import asyncio
+import io
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from downloader.models import DownloadQueue
+from music_manager.models import Album, Artist, Song, SyncJob, YtmusicAuth, YTMusicAuthError, largest_thumbnail
+from music_manager.utils import covers
+from music_manager.utils.async_sync import AsyncClient, run_job_async, sync_album_async
+from music_manager.utils.benchmark import FixtureClient, bench_sync, load_recording, seed_user_content
+from music_manager.utils.pagination import InvalidCursor, decode_cursor, encode_cursor
+from music_manager.utils.profiling import QueryBudgetExceeded, QueryProfileMiddleware, query_budget
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    """
+    The budgeted views run no more queries than QUERY_BUDGETS allows, on a
+    library synced from the benchmark recording. Its artists are cloned so
+    an N+1 over artists, albums or songs blows the budget.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('budget', is_staff=True)
+        YtmusicAuth.objects.create(user=cls.user, auth_file='budget.json')
+        with tempfile.TemporaryDirectory() as tmp:
+            bench_sync(cls.user, FixtureClient(load_recording(), artists=12), Path(tmp) / 'cache.sqlite3')
+        seed_user_content(cls.user)
+        cls.album = Album.objects.filter(songs__isnull=False).order_by('id').first()
+        cls.artist = cls.album.artists.order_by('id').first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertWithinBudget(self, view_name, url):
+        # The first request pays for per-process caches (content types, the search table)
+        self.client.get(url)
+        with query_budget(view_name):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_home(self):
+        self.assertWithinBudget('music_manager:home', reverse('music_manager:home'))
+
+    def test_manage_artists(self):
+        self.assertWithinBudget('music_manager:manage_artists', reverse('music_manager:manage_artists'))
+
+    def test_manage_likes(self):
+        self.assertWithinBudget('music_manager:manage_likes', reverse('music_manager:manage_likes'))
+
+    def test_artists_information(self):
+        self.assertWithinBudget('music_manager:artists_information', reverse('music_manager:artists_information'))
+
+    def test_artist_info(self):
+        url = reverse('music_manager:artist_info', args=[self.artist.slug])
+        self.assertWithinBudget('music_manager:artist_info', url)
+
+    def test_album_info(self):
+        url = reverse('music_manager:album_info', args=[self.artist.slug, self.album.slug])
+        self.assertWithinBudget('music_manager:album_info', url)
+
+    def test_album_tracks(self):
+        url = reverse('music_manager:album_tracks', args=[self.artist.slug, self.album.slug])
+        self.assertWithinBudget('music_manager:album_tracks', url)
+
+    def fetching_album(self):
+        """An album whose tracks are queued, as after the first visit to its page"""
+        album = Album.objects.filter(artists=self.artist).exclude(pk=self.album.pk).order_by('id').first()
+        Album.objects.filter(pk=album.pk).update(need_tracks=True)
+        SyncJob.enqueue_album(self.user, album)
+        return album
+
+    def test_album_info_while_fetching(self):
+        url = reverse('music_manager:album_info', args=[self.artist.slug, self.fetching_album().slug])
+        self.assertWithinBudget('music_manager:album_info', url)
+
+    def test_album_tracks_while_fetching(self):
+        # The album page polls this until the sync worker has the tracks
+        url = reverse('music_manager:album_tracks', args=[self.artist.slug, self.fetching_album().slug])
+        self.assertWithinBudget('music_manager:album_tracks', url)
+
+    def test_search(self):
+        self.assertWithinBudget('music_manager:search', reverse('music_manager:search') + '?q=the')
+
+    def test_search_typeahead(self):
+        self.assertWithinBudget('music_manager:search_typeahead', reverse('music_manager:search_typeahead') + '?q=th')
+
+    def test_over_budget_fails(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(1):
+                list(Album.objects.all())
+                list(Album.objects.all())
+
+
+class CoverArtRetryTests(TestCase):
+    """A cover that fails to download keeps its URL and is fetched again later"""
+
+    url = 'https://example.com/cover.jpg'
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.enterContext(override_settings(COVER_ART_ROOT=root.name))
+        self.album = Album.objects.create(title='Discovery', browseId='MPREb_1', thumbnail_url=self.url)
+
+    @staticmethod
+    def image():
+        buffer = io.BytesIO()
+        Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_failed_fetch_is_retried(self):
+        with mock.patch.object(covers, 'download', side_effect=requests.ConnectionError('reset')):
+            self.assertEqual(covers.fetch_missing(), 0)
+        self.album.refresh_from_db()
+        self.assertEqual(self.album.thumbnail_url, self.url)
+        self.assertEqual(self.album.thumbnail_failures, 1)
+        self.assertGreater(self.album.thumbnail_retry_at, timezone.now())
+        # Not before its retry time
+        self.assertEqual(covers.pending(), {})
+
+        Album.objects.filter(pk=self.album.pk).update(thumbnail_retry_at=timezone.now() - timedelta(seconds=1))
+        with mock.patch.object(covers, 'download', return_value=self.image()) as download:
+            self.assertEqual(covers.fetch_missing(), 1)
+        download.assert_called_once_with(self.url)
+        self.album.refresh_from_db()
+        self.assertTrue(self.album.cover_art)
+        self.assertEqual(self.album.thumbnail_failures, 0)
+        self.assertIsNone(self.album.thumbnail_retry_at)
+
+    def test_retry_delay_grows(self):
+        self.assertLess(covers.retry_delay(1), covers.retry_delay(2))
+        self.assertEqual(covers.retry_delay(100).total_seconds(), settings.COVER_ART_RETRY_MAX)
+
+
+@override_settings(QUERY_PROFILE_HEADERS=True)
+class QueryProfileMiddlewareTests(TestCase):
+    """The middleware profiles sync and async views without forcing async ones onto a thread"""
+
+    def get_response(self, request):
+        list(Album.objects.all())
+        list(Artist.objects.all())
+        return HttpResponse()
+
+    async def aget_response(self, request):
+        await sync_to_async(self.get_response)(request)
+        return HttpResponse()
+
+    def test_sync(self):
+        middleware = QueryProfileMiddleware(self.get_response)
+        self.assertFalse(iscoroutinefunction(middleware))
+        response = middleware(RequestFactory().get('/'))
+        self.assertEqual(response['X-Query-Count'], '2')
+
+    async def test_async(self):
+        middleware = QueryProfileMiddleware(self.aget_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with query_budget(2) as profile:
+            response = await middleware(RequestFactory().get('/'))
+        # Counted on the sync_to_async thread, for the request and the profile around it
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertEqual(profile.queries, 2)
+
+
+class SongDetailsTests(TestCase):
+    """Songs made from a track list fetch get_song once, when they are downloaded"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('details')
+        recording = load_recording()
+        cls.video_id = next(iter(recording['get_song']))
+        cls.song_info = recording['get_song'][cls.video_id]
+        cls.song = Song.objects.create(title='Track', videoId=cls.video_id)
+
+    def client_mock(self):
+        return mock.Mock(get_song=mock.Mock(return_value=self.song_info))
+
+    def test_get_details_runs_once(self):
+        ytmusic = self.client_mock()
+        self.song.get_details(ytmusic)
+        self.assertEqual(self.song.url, self.song_info['microformat']['microformatDataRenderer']['urlCanonical'])
+        ytmusic.get_song.assert_called_once_with(self.video_id)
+
+        song = Song.objects.get(pk=self.song.pk)
+        song.get_details(ytmusic)
+        ytmusic.get_song.assert_called_once()
+
+    def test_download_queues_canonical_url(self):
+        self.client.force_login(self.user)
+        ytmusic = self.client_mock()
+        url = reverse('music_manager:download_song', args=[self.song.pk])
+        with mock.patch('music_manager.views.get_user_ytmusic_client', return_value=ytmusic):
+            self.client.post(url)
+            self.client.post(url)
+        ytmusic.get_song.assert_called_once()
+        urls = list(DownloadQueue.objects.values_list('url', flat=True))
+        self.assertEqual(urls, [Song.objects.get(pk=self.song.pk).url] * 2)
+
+
+class AsyncSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('async')
+        YtmusicAuth.objects.create(user=cls.user, auth_file='async.json')
+
+    async def test_job_records_the_error_not_the_group(self):
+        client = mock.Mock()
+        client.get_library_subscriptions.return_value = [{'browseId': 'UC1', 'artist': 'Daft Punk'}]
+        client.get_artist.side_effect = YTMusicAuthError("Token expired")
+        job = await sync_to_async(SyncJob.enqueue)(self.user)
+        with mock.patch('music_manager.utils.async_sync.job_client', return_value=client):
+            job = await run_job_async(job, asyncio.Semaphore(2))
+        self.assertEqual(job.status, SyncJob.STATUS_FAILED)
+        self.assertEqual(job.error, "Token expired")
+
+    async def test_album_refresh_matches_the_sync_path(self):
+        recording = load_recording()
+        browse_id = next(iter(recording['get_album']))
+        album = await Album.objects.acreate(
+            title='Old', browseId=browse_id, thumbnail_url='https://example.com/old.jpg', need_tracks=True,
+        )
+        await sync_album_async(AsyncClient(FixtureClient(recording), asyncio.Semaphore(2)), browse_id)
+        await album.arefresh_from_db()
+        album_info = recording['get_album'][browse_id]
+        self.assertEqual(album.thumbnail_url, largest_thumbnail(album_info['thumbnails']))
+        self.assertEqual(album.fingerprint, Album.tracks_fingerprint(album_info['tracks']))
+        self.assertFalse(album.need_tracks)
+        self.assertTrue(await album.songs.aexists())
+
+
+class SlugTests(TestCase):
+    def test_artist_slug_ignores_longer_slugs_with_its_prefix(self):
+        Artist.objects.create(name='The XX', channelId='UC1')
+        Artist.objects.create(name='Theo', channelId='UC2')
+        with self.assertNumQueries(3):
+            # One lookup of 'the', the insert and its search entry
+            first = Artist.objects.create(name='The', channelId='UC3')
+        second = Artist.objects.create(name='The', channelId='UC4')
+        self.assertEqual((first.slug, second.slug), ('the', 'the-2'))
+
+    def test_album_slugs_are_unique_per_artist(self):
+        artist = Artist.objects.create(name='Daft Punk', channelId='UC1')
+        other = Artist.objects.create(name='Justice', channelId='UC2')
+        albums = [Album.objects.create(title='Discovery', browseId=f'MPREb_{i}') for i in range(3)]
+        for album in albums[:2]:
+            album.artists.add(artist)
+        albums[2].artists.add(other)
+        self.assertEqual(
+            [album.slug for album in Album.objects.order_by('id')], ['discovery', 'discovery-2', 'discovery'],
+        )
+
+
+class CursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cursor')
+        for i in range(3):
+            Artist.objects.create(name=f'Artist {i}', channelId=f'UC{i}')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def page(self, cursor):
+        return self.client.get(reverse('music_manager:artists_information'), {'after': cursor, 'limit': 1})
+
+    def test_decode_rejects_values_a_cursor_never_holds(self):
+        self.assertEqual(decode_cursor(encode_cursor(['Artist 0', 1]), 2), ['Artist 0', 1])
+        for values in ([[1], {'a': 1}], ['Artist 0'], {'name': 'Artist 0', 'id': 1}):
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                decode_cursor(encode_cursor(values), 2)
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not base64!', 2)
+
+    def test_tampered_cursor_is_a_bad_request(self):
+        self.assertEqual(self.page(encode_cursor(['Artist 0', Artist.objects.get(name='Artist 0').id])).status_code, 200)
+        for cursor in (encode_cursor([[1], {'a': 1}]), encode_cursor(['Artist 0', 'one']), '%%%'):
+            with self.subTest(cursor=cursor):
+                self.assertEqual(self.page(cursor).status_code, 400)
@@ -12,8 +12,17 @@ urlpatterns = [
     path('ytmusic-auth/', views.setup_ytmusic_auth, name='ytmusic_auth'),
     path('ytmusic-callback/', views.ytmusic_callback, name='ytmusic_callback'),
     path('user-information/', views.user_information, name='user_information'),
+    path('search/', views.search_library, name='search'),
+    path('search/typeahead/', views.search_typeahead, name='search_typeahead'),
     path('artists/', views.artists_information, name='artists_information'),
     path('artists/<slug:artist_slug>/', views.artist_info, name='artist_info'),
     path('artists/<slug:artist_slug>/<slug:album_slug>/', views.album_info, name='album_info'),
+    path('artists/<slug:artist_slug>/<slug:album_slug>/tracks/', views.album_tracks, name='album_tracks'),
+    path('songs/<int:song_id>/download/', views.download_song, name='download_song'),
     path('manage_artists/get_albums', views.get_albums, name='get_albums'),
+    path('sync-progress/', views.sync_progress, name='sync_progress'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('fragments/artists/<int:artist_id>/albums/', views.artist_albums, name='artist_albums'),
+    path('fragments/albums/<int:album_id>/songs/', views.album_song_list, name='album_song_list'),
+    path('covers/<str:digest>/<int:size>.<str:extension>', views.cover_art, name='cover_art'),
 ]
\ No newline at end of file
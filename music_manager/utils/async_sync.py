@@ -0,0 +1,171 @@
+# utils/async_sync.py
+"""
+asyncio version of the sync worker. One event loop runs several users' jobs
+and many YouTube Music calls at once, bounded by semaphores instead of one
+thread per blocked call. ytmusicapi itself is built on requests, so each
+call is handed to a thread while the loop waits on it, and every database
+write goes through sync_to_async's single shared thread.
+"""
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from music_manager.models import Album, Artist, SyncJob, SyncTask, YTMusicAuthError
+from music_manager.utils import metrics
+from music_manager.utils.ingest import (
+    finish_artist_sync, ingest_albums, link_known_albums, refresh_album, start_artist_sync,
+)
+from music_manager.utils.pipeline import batched
+from music_manager.utils.sync import (
+    claim_next_job, fetch_cover_art, finish_job, finish_task, job_client, plan_tasks, recover_interrupted, start_task,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncClient:
+    """Awaitable wrapper around a YTMusic client, limited by a shared semaphore"""
+
+    def __init__(self, client, semaphore):
+        self._client = client
+        self._semaphore = semaphore
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+
+        async def call(*args, **kwargs):
+            async with self._semaphore:
+                return await asyncio.to_thread(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+async def get_discography_async(artist, artist_info, client):
+    """The async counterpart of Artist.get_discography's album listing"""
+    albums = []
+    listings = []
+    for section, browse_id, params in (
+        ('albums', artist.album_browseId, artist.album_params),
+        ('singles', artist.singles_browseId, artist.singles_params),
+    ):
+        if params != 'None':
+            listings.append(client.get_artist_albums(browse_id, params))
+        elif section in artist_info:
+            albums.extend(artist_info[section]['results'])
+    for results in await asyncio.gather(*listings):
+        albums.extend(results)
+    return albums
+
+
+async def make_albums_async(artist, albums, client):
+    new_ids = await sync_to_async(link_known_albums)(artist, albums)
+    album_infos = await asyncio.gather(*(client.get_album(browse_id) for browse_id in new_ids))
+    for batch in batched(zip(new_ids, album_infos)):
+        await sync_to_async(ingest_albums)(artist, batch)
+
+
+async def sync_artist_async(client, channel_id):
+    """sync.sync_artist with the discography's API calls made concurrently"""
+    artist_info = await client.get_artist(channel_id)
+    artist, created = await Artist.objects.aget_or_create(
+        channelId=artist_info['channelId'], defaults={'name': artist_info['name']},
+    )
+    fingerprint = await sync_to_async(start_artist_sync)(artist, artist_info)
+    if fingerprint is not None:
+        albums = await get_discography_async(artist, artist_info, client)
+        await make_albums_async(artist, albums, client)
+    await sync_to_async(finish_artist_sync)(artist, fingerprint)
+    logger.info(f"Artist {artist.name}, new: {created}, discography changed: {fingerprint is not None}")
+    return artist
+
+
+async def sync_album_async(client, browse_id):
+    album_info = None
+    async for album in Album.objects.filter(browseId=browse_id):
+        if album_info is None:
+            album_info = await client.get_album(browse_id)
+        await sync_to_async(refresh_album)(album, album_info)
+
+
+def root_error(error):
+    """The exception that ended a TaskGroup, instead of the ExceptionGroup wrapping it"""
+    while isinstance(error, BaseExceptionGroup):
+        error = error.exceptions[0]
+    return error
+
+
+TASK_HANDLERS = {
+    SyncTask.KIND_ARTIST: sync_artist_async,
+    SyncTask.KIND_ALBUM: sync_album_async,
+}
+
+
+async def run_task_async(task, client, task_slots):
+    async with task_slots:
+        if task.attempts:
+            await asyncio.sleep(settings.SYNC_RETRY_BACKOFF * task.attempts)
+        await sync_to_async(start_task)(task)
+        try:
+            with metrics.timed('sync_step_seconds', step=task.kind):
+                await TASK_HANDLERS[task.kind](client, task.target_id)
+        except YTMusicAuthError:
+            raise
+        except Exception as e:
+            return await sync_to_async(finish_task)(task, e)
+        return await sync_to_async(finish_task)(task)
+
+
+async def run_job_async(job, api_slots):
+    """Run a job's tasks concurrently, at most SYNC_ASYNC_TASKS_PER_JOB at a time"""
+    logger.info(f"Starting {job}")
+    task_slots = asyncio.Semaphore(settings.SYNC_ASYNC_TASKS_PER_JOB)
+    try:
+        ytmusic_client = await sync_to_async(job_client)(job)
+        await sync_to_async(plan_tasks)(job, ytmusic_client)
+        client = AsyncClient(ytmusic_client, api_slots)
+
+        while True:
+            pending = [task async for task in job.tasks.filter(status=SyncTask.STATUS_PENDING)]
+            if not pending:
+                break
+            # A failure that ends the job (e.g. lost auth) cancels the job's other tasks
+            async with asyncio.TaskGroup() as group:
+                for task in pending:
+                    group.create_task(run_task_async(task, client, task_slots))
+    except Exception as e:
+        return await sync_to_async(finish_job)(job, root_error(e))
+    return await sync_to_async(finish_job)(job)
+
+
+async def run_worker_async(poll_interval=None, once=False, concurrency=None):
+    """
+    Claim jobs as long as fewer than `concurrency` are running and run them
+    side by side on this event loop
+    """
+    poll_interval = poll_interval or settings.SYNC_POLL_INTERVAL
+    concurrency = concurrency or settings.SYNC_ASYNC_JOBS
+    api_slots = asyncio.Semaphore(settings.SYNC_ASYNC_API_CALLS)
+    running = set()
+
+    await sync_to_async(recover_interrupted)()
+    while True:
+        while len(running) < concurrency:
+            job = await sync_to_async(claim_next_job)()
+            if job is None:
+                break
+            running.add(asyncio.create_task(run_job_async(job, api_slots)))
+
+        if not running:
+            if await sync_to_async(fetch_cover_art)():
+                continue
+            if once:
+                return
+            await asyncio.sleep(poll_interval)
+            continue
+
+        done, running = await asyncio.wait(running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+        for finished in done:
+            finished.result()
@@ -0,0 +1,347 @@
+# utils/benchmark.py
+"""
+Offline benchmarks of the sync pipeline and the heaviest library pages.
+
+YouTube Music is replaced by FixtureClient, which replays payloads recorded
+from the real API (benchmarks/ytmusic_recording.json, refreshed with the
+record_ytmusic_fixtures command). It clones the recorded artists to build
+a library of any size and can add latency per call. run_benchmarks runs
+everything in a throwaway test database and returns JSON-ready results.
+"""
+import json
+import logging
+import platform
+import random
+import re
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from music_manager.models import (
+    Album, Artist, RatingSummary, Song, SyncJob, SyncTask, UserFavorite, UserRating, YtmusicAuth,
+)
+from music_manager.utils.cache import CachedClient, ResponseCache
+from music_manager.utils import metrics
+from music_manager.utils.metrics import InstrumentedClient
+from music_manager.utils.profiling import QueryProfile
+from music_manager.utils.sync import claim_next_job, run_job
+from music_manager.utils.testing import models_only
+
+logger = logging.getLogger(__name__)
+
+RECORDING_PATH = Path(__file__).resolve().parent.parent / 'benchmarks' / 'ytmusic_recording.json'
+ENDPOINTS = ('get_library_subscriptions', 'get_artist', 'get_artist_albums', 'get_album', 'get_song')
+
+# Copies of recorded ids get '.<copy>' appended, albums added by new_releases also get NEW
+NEW = '.new'
+
+
+def load_recording(path=None):
+    with open(path or RECORDING_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class FixtureClient:
+    """
+    Stands in for a YTMusic client using a recording. Asking for more
+    artists than were recorded clones them with suffixed ids, so the
+    payloads keep their real shape and size. With new_releases, that
+    fraction of artists has one more album than recorded, as an
+    incremental sync would find after a release day.
+    """
+
+    def __init__(self, recording, artists=None, latency=0.0, jitter=0.0, new_releases=0.0, seed=0):
+        self.recording = recording
+        self.artists = artists or len(recording['get_library_subscriptions'])
+        self.latency = latency
+        self.jitter = jitter
+        self.new_release_every = round(1 / new_releases) if new_releases else 0
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._channels = [sub['browseId'] for sub in recording['get_library_subscriptions']]
+        ids = set(self._channels) | set(recording['get_album']) | set(recording['get_song'])
+        ids |= {key.split('|')[0] for key in recording['get_artist_albums']}
+        # Longest first, so an id that contains another (MPAD<channel id>) is renamed as a whole
+        self._ids = re.compile('|'.join(re.escape(i) for i in sorted(ids, key=len, reverse=True)))
+
+    def _call(self, endpoint):
+        with self._lock:
+            self.calls[endpoint] += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def _clone(self, payload, copy):
+        if not copy:
+            return json.loads(json.dumps(payload))
+        text = self._ids.sub(lambda match: f'{match.group(0)}.{copy}', json.dumps(payload))
+        return json.loads(text)
+
+    @staticmethod
+    def _split(key):
+        base, _, copy = key.rpartition('.')
+        return (base, int(copy)) if copy.isdigit() else (key, 0)
+
+    def _artist_index(self, channel_id):
+        base, copy = self._split(channel_id)
+        return copy * len(self._channels) + self._channels.index(base), base, copy
+
+    def _has_new_release(self, index):
+        return bool(self.new_release_every) and index % self.new_release_every == 0
+
+    def _new_release(self, releases):
+        album = dict(releases[0])
+        album['browseId'] += NEW
+        album['title'] += ' (Deluxe Edition)'
+        return album
+
+    def get_library_subscriptions(self, limit=25, order=None):
+        self._call('get_library_subscriptions')
+        subscriptions = self.recording['get_library_subscriptions']
+        result = []
+        for index in range(min(limit, self.artists)):
+            copy, position = divmod(index, len(subscriptions))
+            subscription = self._clone(subscriptions[position], copy)
+            if copy:
+                subscription['artist'] = f"{subscription['artist']} {copy}"
+            result.append(subscription)
+        return result
+
+    def get_artist(self, channelId):
+        self._call('get_artist')
+        index, base, copy = self._artist_index(channelId)
+        artist = self._clone(self.recording['get_artist'][base], copy)
+        if copy:
+            artist['name'] = f"{artist['name']} {copy}"
+        if self._has_new_release(index) and artist['albums']['results']:
+            artist['albums']['results'].insert(0, self._new_release(artist['albums']['results']))
+        return artist
+
+    def get_artist_albums(self, channelId, params, limit=100, order=None):
+        self._call('get_artist_albums')
+        base, copy = self._split(channelId)
+        albums = self._clone(self.recording['get_artist_albums'][f'{base}|{params}'], copy)
+        index, _, _ = self._artist_index(base[len('MPAD'):] + (f'.{copy}' if copy else ''))
+        if self._has_new_release(index) and albums and albums[0]['type'] == 'Album':
+            albums.insert(0, self._new_release(albums))
+        return albums
+
+    def get_album(self, browseId):
+        self._call('get_album')
+        new = browseId.endswith(NEW)
+        base, copy = self._split(browseId[:-len(NEW)] if new else browseId)
+        album = self._clone(self.recording['get_album'][base], copy)
+        if new:
+            album['title'] += ' (Deluxe Edition)'
+            for track in album['tracks']:
+                track['videoId'] += NEW
+        return album
+
+    def get_song(self, videoId):
+        self._call('get_song')
+        new = videoId.endswith(NEW)
+        base, copy = self._split(videoId[:-len(NEW)] if new else videoId)
+        return self._clone(self.recording['get_song'][base], copy)
+
+
+class RecordingClient:
+    """Wraps a real client and keeps every benchmarked endpoint's responses in the recording format"""
+
+    def __init__(self, client):
+        self._client = client
+        self.recording = {'get_library_subscriptions': [], 'get_artist': {}, 'get_artist_albums': {}, 'get_album': {}, 'get_song': {}}
+
+    def get_library_subscriptions(self, limit=25):
+        result = self._client.get_library_subscriptions(limit=limit)
+        self.recording['get_library_subscriptions'] = result
+        return result
+
+    def get_artist(self, channelId):
+        self.recording['get_artist'][channelId] = result = self._client.get_artist(channelId)
+        return result
+
+    def get_artist_albums(self, channelId, params, limit=100):
+        self.recording['get_artist_albums'][f'{channelId}|{params}'] = result = self._client.get_artist_albums(channelId, params, limit=limit)
+        return result
+
+    def get_album(self, browseId):
+        self.recording['get_album'][browseId] = result = self._client.get_album(browseId)
+        return result
+
+    def get_song(self, videoId):
+        self.recording['get_song'][videoId] = result = self._client.get_song(videoId)
+        return result
+
+
+def record(ytmusic_client, artists=5, songs_per_album=1):
+    """
+    Make a recording from the user's first subscriptions: their artist pages,
+    discographies, every album and the first songs of each album
+    """
+    client = RecordingClient(ytmusic_client)
+    for subscription in client.get_library_subscriptions(limit=artists):
+        artist = client.get_artist(subscription['browseId'])
+        releases = []
+        for section in ('albums', 'singles'):
+            if section not in artist:
+                continue
+            if artist[section].get('params'):
+                releases.extend(client.get_artist_albums(artist[section]['browseId'], artist[section]['params']))
+            else:
+                releases.extend(artist[section]['results'])
+        for release in releases:
+            album = client.get_album(release['browseId'])
+            for track in album['tracks'][:songs_per_album]:
+                if track.get('videoId'):
+                    client.get_song(track['videoId'])
+    return client.recording
+
+
+# -------------------------------
+# Measurements
+
+def bench_sync(user, fixture_client, cache_path):
+    """Run one library sync job through the real worker code against the fixture client"""
+    client = CachedClient(InstrumentedClient(fixture_client), ResponseCache(cache_path, settings.YTMUSIC_CACHE_MAX_BYTES))
+    before = {model.__name__: model.objects.count() for model in (Artist, Album, Song)}
+    calls_before = Counter(fixture_client.calls)
+
+    SyncJob.enqueue(user, SyncJob.KIND_LIBRARY)
+    job = claim_next_job()
+    with QueryProfile() as profile:
+        run_job(job, ytmusic_client=client)
+
+    job.refresh_from_db()
+    return {
+        'seconds': round(profile.seconds, 4),
+        'queries': profile.queries,
+        'query_seconds': round(profile.db_seconds, 4),
+        'api_calls': dict(fixture_client.calls - calls_before),
+        'created': {name: model.objects.count() - before[name] for name, model in (('Artist', Artist), ('Album', Album), ('Song', Song))},
+        'status': job.status,
+        'failed_tasks': job.tasks.filter(status=SyncTask.STATUS_FAILED).count(),
+    }
+
+
+def seed_user_content(user, seed=0):
+    """Ratings and favorites for a share of the synced library, so the pages have something to show"""
+    rnd = random.Random(seed)
+    now = timezone.now()
+    ratings, favorites = [], []
+    for model, share in ((Artist, 0.5), (Album, 0.3), (Song, 0.1)):
+        content_type = ContentType.objects.get_for_model(model)
+        for object_id in model.objects.values_list('id', flat=True):
+            if rnd.random() < share:
+                ratings.append(UserRating(user=user, content_type=content_type, object_id=object_id, rating=rnd.randint(-5, 5)))
+            if rnd.random() < share / 2:
+                favorites.append(UserFavorite(user=user, content_type=content_type, object_id=object_id, date_favorited=now))
+    UserRating.objects.bulk_create(ratings)
+    UserFavorite.objects.bulk_create(favorites)
+    # bulk_create skips the signal that maintains the summaries
+    RatingSummary.rebuild()
+    return {'ratings': len(ratings), 'favorites': len(favorites)}
+
+
+def bench_view(client, url, repeat):
+    timings = []
+    for _ in range(repeat):
+        with QueryProfile() as profile:
+            response = client.get(url)
+        timings.append(profile.seconds)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+    return {
+        'min_ms': round(min(timings) * 1000, 2),
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'queries': profile.queries,
+        'query_ms': round(profile.db_seconds * 1000, 2),
+        'template_ms': round(profile.template_seconds * 1000, 2),
+        'bytes': len(response.content),
+    }
+
+
+VIEWS = {
+    'home': 'music_manager:home',
+    'manage_artists': 'music_manager:manage_artists',
+    'manage_likes': 'music_manager:manage_likes',
+}
+
+
+def git_revision():
+    """(commit, has uncommitted changes) of the checkout, or (None, None) outside git"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def run_benchmarks(artists=50, latency=0.0, jitter=0.0, new_releases=0.1, repeat=5, recording=None):
+    """
+    Full sync, incremental sync and page benchmarks in a fresh test
+    database. Nothing touches the configured database, the response cache
+    or YouTube Music.
+    """
+    recording = recording or load_recording()
+    commit, dirty = git_revision()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'parameters': {
+            'artists': artists, 'latency': latency, 'jitter': jitter, 'new_releases': new_releases, 'repeat': repeat,
+        },
+        'benchmarks': {},
+    }
+
+    setup_test_environment()
+    with models_only():
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(METRICS_DIR=None), tempfile.TemporaryDirectory() as tmp:
+            user = User.objects.create_user('benchmark', is_staff=True)
+            YtmusicAuth.objects.create(user=user, auth_file='benchmark.json')
+
+            first = FixtureClient(recording, artists=artists, latency=latency, jitter=jitter)
+            results['benchmarks']['full_sync'] = bench_sync(user, first, Path(tmp) / 'full.sqlite3')
+            # A later sync with a cold response cache: unchanged artists stop at get_artist
+            later = FixtureClient(recording, artists=artists, latency=latency, jitter=jitter, new_releases=new_releases)
+            results['benchmarks']['incremental_sync'] = bench_sync(user, later, Path(tmp) / 'incremental.sqlite3')
+
+            results['library'] = seed_user_content(user)
+            client = Client()
+            client.force_login(user)
+            for name, url_name in VIEWS.items():
+                url = reverse(url_name)
+                client.get(url)  # Template loading and the first-query overhead aren't what we measure
+                results['benchmarks'][f'view_{name}'] = bench_view(client, url, repeat)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        # The fixture client's calls must not end up in the real METRICS_DIR when the process exits
+        metrics.registry.clear()
+    return results
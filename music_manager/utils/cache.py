@@ -0,0 +1,154 @@
+# utils/cache.py
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+from music_manager.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+_MISS = object()
+
+
+class ResponseCache:
+    """
+    On-disk store of raw ytmusicapi responses keyed by endpoint and arguments.
+    Entries expire after the endpoint's TTL and the least recently used ones
+    are evicted once the store grows past max_bytes.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The sync worker and web processes share the file, WAL lets them read while one writes
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " endpoint TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " expires_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(endpoint, args, kwargs):
+        return endpoint + ':' + json.dumps([args, kwargs], sort_keys=True, default=str)
+
+    def get(self, key):
+        """Return the cached value or _MISS"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return _MISS
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, endpoint, value, ttl):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, endpoint, value, size, expires_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, endpoint, data, len(data), now + ttl, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used until under max_bytes"""
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        evicted = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logger.debug(f"Evicted {len(evicted)} cached YouTube Music responses")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'bytes': size,
+        }
+
+
+class CachedClient:
+    """
+    Wraps a YTMusic client so calls to the endpoints in YTMUSIC_CACHE_TTLS are
+    answered from the response cache. With bypass=True the API is always
+    called and the cache is refreshed with the new response.
+    """
+
+    def __init__(self, client, cache, ttls=None, bypass=False):
+        self._client = client
+        self._cache = cache
+        self._ttls = settings.YTMUSIC_CACHE_TTLS if ttls is None else ttls
+        self.bypass = bypass
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name not in self._ttls:
+            return attr
+
+        def call(*args, **kwargs):
+            key = self._cache.make_key(name, args, kwargs)
+            if not self.bypass:
+                value = self._cache.get(key)
+                if value is not _MISS:
+                    metrics.inc('ytmusic_cache_requests_total', endpoint=name, result='hit')
+                    return value
+            metrics.inc('ytmusic_cache_requests_total', endpoint=name, result='bypass' if self.bypass else 'miss')
+            value = attr(*args, **kwargs)
+            self._cache.set(key, name, value, self._ttls[name])
+            return value
+
+        call.__name__ = name
+        return call
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """The process wide response cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(settings.YTMUSIC_CACHE_PATH, settings.YTMUSIC_CACHE_MAX_BYTES)
+        return _cache
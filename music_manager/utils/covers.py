@@ -0,0 +1,232 @@
+# utils/covers.py
+"""
+Cover art pipeline. Album covers and artist images are downloaded from the
+thumbnail URLs in the get_album/get_artist payloads on a small thread pool
+and stored once per distinct image under COVER_ART_ROOT, named by the
+SHA-256 of the bytes. Each image is cut into square WebP and JPEG
+thumbnails of COVER_ART_SIZES, and pages only ever link those thumbnails
+(served by views.cover_art), never the original or the remote URL.
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+import requests
+from PIL import Image, ImageOps, UnidentifiedImageError
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from music_manager.models import Album, Artist
+
+logger = logging.getLogger(__name__)
+
+# Thumbnail extension -> (Pillow format, save options, content type)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}, 'image/webp'),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}, 'image/jpeg'),
+}
+# Models with a thumbnail_url and the image field the pipeline fills
+TARGETS = ((Album, 'cover_art'), (Artist, 'image'))
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+_executor = None
+_session = None
+_lock = threading.Lock()
+
+
+class CoverArtError(Exception):
+    pass
+
+
+def get_executor():
+    """Separate from the ytmusicapi pool, image hosts aren't rate limited like the API"""
+    global _executor, _session
+    with _lock:
+        if _executor is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=settings.COVER_ART_WORKERS)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.COVER_ART_WORKERS,
+                thread_name_prefix='cover-art',
+            )
+        return _executor
+
+
+def original_name(digest, extension):
+    return f'{digest[:2]}/{digest}.{extension}'
+
+
+def thumbnail_name(digest, size, extension):
+    return f'{digest[:2]}/{digest}-{size}.{extension}'
+
+
+def _write(name, data):
+    """Write under COVER_ART_ROOT through a temporary file, so readers never see half an image"""
+    path = os.path.join(settings.COVER_ART_ROOT, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+
+def make_thumbnails(digest, image):
+    """Square crops of every COVER_ART_SIZES in every format, skipping ones already on disk"""
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    for size in settings.COVER_ART_SIZES:
+        resized = None
+        for extension, (pillow_format, options, _) in FORMATS.items():
+            name = thumbnail_name(digest, size, extension)
+            if os.path.exists(os.path.join(settings.COVER_ART_ROOT, name)):
+                continue
+            if resized is None:
+                resized = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, pillow_format, **options)
+            _write(name, buffer.getvalue())
+
+
+def store(data):
+    """
+    Keep an image once per distinct content and make its thumbnails.
+    Returns the name (relative to COVER_ART_ROOT) of the stored original.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise CoverArtError(f"Not an image: {e}") from e
+
+    name = original_name(digest, 'jpg' if image.format == 'JPEG' else image.format.lower())
+    if not os.path.exists(os.path.join(settings.COVER_ART_ROOT, name)):
+        _write(name, data)
+    make_thumbnails(digest, image)
+    return name
+
+
+def download(url):
+    response = _session.get(url, timeout=settings.COVER_ART_TIMEOUT, stream=True)
+    try:
+        response.raise_for_status()
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > settings.COVER_ART_MAX_BYTES:
+                raise CoverArtError(f"Larger than {settings.COVER_ART_MAX_BYTES} bytes")
+    finally:
+        response.close()
+    return bytes(data)
+
+
+def fetch(url):
+    """Download and store one image. Runs on the pool, decoding and resizing release the GIL."""
+    return store(download(url))
+
+
+def thumbnail_path(digest, size, extension):
+    """
+    Path of a thumbnail, generated from the original if it is missing (e.g.
+    after COVER_ART_SIZES changed). Raises FileNotFoundError for unknown
+    digests, sizes or formats.
+    """
+    if not _DIGEST.match(digest) or size not in settings.COVER_ART_SIZES or extension not in FORMATS:
+        raise FileNotFoundError(f"No thumbnail {digest}-{size}.{extension}")
+    path = os.path.join(settings.COVER_ART_ROOT, thumbnail_name(digest, size, extension))
+    if not os.path.exists(path):
+        folder = os.path.join(settings.COVER_ART_ROOT, digest[:2])
+        originals = [entry for entry in os.listdir(folder) if entry.split('.')[0] == digest] if os.path.isdir(folder) else []
+        if not originals:
+            raise FileNotFoundError(f"No cover with digest {digest}")
+        with Image.open(os.path.join(folder, originals[0])) as image:
+            make_thumbnails(digest, image)
+    return path
+
+
+def pending(limit=None):
+    """
+    {thumbnail url: [(model, field, id, failures)]} of artists and albums
+    whose image hasn't been fetched, leaving out those waiting to be retried
+    """
+    now = timezone.now()
+    by_url = defaultdict(list)
+    for model, field in TARGETS:
+        rows = model.objects.filter(
+            thumbnail_url__isnull=False,
+        ).filter(
+            Q(**{field: ''}) | Q(**{f'{field}__isnull': True}),
+        ).filter(
+            Q(thumbnail_retry_at__isnull=True) | Q(thumbnail_retry_at__lte=now),
+        ).values_list('id', 'thumbnail_url', 'thumbnail_failures')
+        for object_id, url, failures in rows[:limit]:
+            by_url[url].append((model, field, object_id, failures))
+    return by_url
+
+
+def retry_delay(failures):
+    """Doubles with every failed fetch of a URL, up to COVER_ART_RETRY_MAX"""
+    seconds = settings.COVER_ART_RETRY_BACKOFF * 2 ** min(failures - 1, 16)
+    return timedelta(seconds=min(seconds, settings.COVER_ART_RETRY_MAX))
+
+
+def fetch_missing(limit=None):
+    """
+    Fetch every missing cover and artist image, each distinct URL once.
+    Only the downloads and thumbnailing run on the pool, this thread does
+    the database writes. A URL that fails is kept and tried again after
+    retry_delay, so a network error doesn't cost an album its cover for
+    good. Returns the number of images stored.
+    """
+    by_url = pending(limit)
+    if not by_url:
+        return 0
+
+    executor = get_executor()
+    futures = {executor.submit(fetch, url): url for url in by_url}
+    stored = 0
+    for future in as_completed(futures):
+        url = futures[future]
+        try:
+            name = future.result()
+        except (requests.RequestException, CoverArtError) as e:
+            logger.warning(f"Could not fetch cover art {url}: {e}")
+            name = None
+        except Exception:
+            # e.g. DecompressionBombError or a full disk, one image must not stop the worker
+            logger.exception(f"Could not store cover art {url}")
+            name = None
+        else:
+            stored += 1
+
+        targets = defaultdict(list)
+        for model, field, object_id, failures in by_url[url]:
+            targets[(model, field, failures)].append(object_id)
+        for (model, field, failures), ids in targets.items():
+            rows = model.objects.filter(id__in=ids, thumbnail_url=url)
+            if name is None:
+                rows.update(
+                    thumbnail_failures=failures + 1,
+                    thumbnail_retry_at=timezone.now() + retry_delay(failures + 1),
+                )
+            else:
+                rows.update(**{field: name}, thumbnail_failures=0, thumbnail_retry_at=None)
+
+    logger.info(f"Stored cover art for {stored} of {len(by_url)} thumbnail URLs")
+    return stored
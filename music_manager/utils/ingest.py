@@ -0,0 +1,189 @@
+# utils/ingest.py
+"""
+Bulk writes of YouTube Music payloads. Each function looks up the rows that
+already exist with one query, inserts the rest with bulk_create and fills
+the many-to-many tables in one batch, instead of get_or_create per item.
+
+Both sync pipelines (utils/sync.py through the models, utils/async_sync.py
+through sync_to_async) make their API calls their own way and write what
+they fetched with these functions, so the two can't drift apart.
+"""
+import logging
+
+from django.db import transaction
+from django.utils import timezone
+
+from music_manager.models import Album, AlbumSong, Artist, Song, slug_base, unique_slug
+from music_manager.utils import metrics, search
+
+logger = logging.getLogger(__name__)
+
+
+def _usable_tracks(tracks):
+    return [track for track in tracks if track.get('videoId') not in (None, 'None')]
+
+
+def ingest_tracks(album, tracks, artists=None, replace=False):
+    """
+    Create the songs of an album from its get_album track list and link
+    every track to the album. New songs get the album's artists as primary artists.
+    With replace, links the track list no longer has (removed or renumbered
+    tracks) are deleted. Returns the number of songs created.
+    """
+    tracks = _usable_tracks(tracks)
+    if not tracks:
+        return 0
+    if artists is None:
+        artists = list(album.artists.all())
+
+    with metrics.timed('sync_step_seconds', step='ingest_tracks'), transaction.atomic():
+        video_ids = [track['videoId'] for track in tracks]
+        song_ids = dict(Song.objects.filter(videoId__in=video_ids).values_list('videoId', 'id'))
+
+        new_songs = {}
+        for track in tracks:
+            if track['videoId'] in song_ids or track['videoId'] in new_songs:
+                continue
+            song = Song()
+            song.populate_from_track(track)
+            new_songs[song.videoId] = song
+        Song.objects.bulk_create(new_songs.values())
+
+        if new_songs:
+            song_ids.update(Song.objects.filter(videoId__in=new_songs).values_list('videoId', 'id'))
+            # bulk_create skips the post_save signal that normally indexes them
+            for video_id, song in new_songs.items():
+                song.id = song_ids[video_id]
+            search.index_objects(new_songs.values())
+
+        links = {(song_ids[track['videoId']], track.get('trackNumber')) for track in tracks}
+        if replace:
+            stale = [
+                link_id
+                for link_id, song_id, track_number in AlbumSong.objects.filter(album=album).values_list(
+                    'id', 'song_id', 'track_number',
+                )
+                if (song_id, track_number) not in links
+            ]
+            AlbumSong.objects.filter(id__in=stale).delete()
+        AlbumSong.objects.bulk_create([
+            AlbumSong(album=album, song_id=song_id, track_number=track_number)
+            for song_id, track_number in links
+        ], ignore_conflicts=True)
+
+        SongArtist = Song.primary_artists.through
+        SongArtist.objects.bulk_create([
+            SongArtist(song_id=song_ids[video_id], artist_id=artist.id)
+            for video_id in new_songs
+            for artist in artists
+        ], ignore_conflicts=True)
+
+    metrics.inc('sync_items_created_total', len(new_songs), kind='song')
+    logger.debug(f"Ingested {len(tracks)} tracks for {album}, {len(new_songs)} new")
+    return len(new_songs)
+
+
+def link_albums(artist, album_ids):
+    """Add the artist to every album in one insert, skipping existing links"""
+    AlbumArtist = Album.artists.through
+    AlbumArtist.objects.bulk_create([
+        AlbumArtist(album_id=album_id, artist_id=artist.id)
+        for album_id in album_ids
+    ], ignore_conflicts=True)
+
+
+def start_artist_sync(artist, artist_info):
+    """
+    Apply a get_artist response to the artist. Returns the discography
+    fingerprint if the releases changed since the last sync, in which case
+    the discography is to be ingested before finish_artist_sync, else None.
+    """
+    fingerprint = Artist.discography_fingerprint(artist_info)
+    changed = artist.need_discography or fingerprint != artist.fingerprint
+    artist.populate(artist_info)
+    if not changed:
+        return None
+    artist.save()
+    return fingerprint
+
+
+def finish_artist_sync(artist, fingerprint=None):
+    """Record a finished sync, with the fingerprint start_artist_sync returned once the discography is in"""
+    if fingerprint is not None:
+        artist.fingerprint = fingerprint
+        artist.need_discography = False
+    artist.last_synced = timezone.now()
+    artist.save()
+
+
+def link_known_albums(artist, albums):
+    """
+    Link the artist to the albums of a discography listing that are already
+    stored. Returns the browseIds of the others, which need a get_album.
+    """
+    browse_ids = list(dict.fromkeys(album['browseId'] for album in albums))
+    existing = dict(Album.objects.filter(browseId__in=browse_ids).values_list('browseId', 'id'))
+    link_albums(artist, existing.values())
+    return [browse_id for browse_id in browse_ids if browse_id not in existing]
+
+
+def refresh_album(album, album_info):
+    """
+    Bring a stored album up to date with a get_album response: its cover,
+    and its tracks if the track list changed since the last sync
+    """
+    tracks = album_info['tracks']
+    fingerprint = Album.tracks_fingerprint(tracks)
+    album.set_thumbnail(album_info.get('thumbnails'))
+    if album.need_tracks or fingerprint != album.fingerprint:
+        album.make_tracks(tracks)
+        album.fingerprint = fingerprint
+    album.need_tracks = False
+    album.last_synced = timezone.now()
+    album.save()
+    return tracks
+
+
+def ingest_albums(artist, album_infos):
+    """
+    Create albums (and their tracks) from (browseId, get_album payload) pairs
+    and link them all to the artist. Returns the number of albums created.
+    """
+    album_infos = list(album_infos)
+    if not album_infos:
+        return 0
+
+    now = timezone.now()
+    with metrics.timed('sync_step_seconds', step='ingest_albums'), transaction.atomic():
+        browse_ids = [browse_id for browse_id, _ in album_infos]
+        album_ids = dict(Album.objects.filter(browseId__in=browse_ids).values_list('browseId', 'id'))
+
+        new_albums = {}
+        taken = set(Album.album_slugs_taken([artist]))
+        for browse_id, album_info in album_infos:
+            if browse_id in album_ids or browse_id in new_albums:
+                continue
+            album = Album(browseId=browse_id, need_tracks=False, last_synced=now)
+            album.populate(album_info)
+            album.fingerprint = Album.tracks_fingerprint(album_info['tracks'])
+            album.slug = unique_slug(slug_base(album.title, browse_id), taken)
+            taken.add(album.slug)
+            new_albums[browse_id] = album
+        Album.objects.bulk_create(new_albums.values())
+
+        if new_albums:
+            album_ids.update(Album.objects.filter(browseId__in=new_albums).values_list('browseId', 'id'))
+
+        link_albums(artist, album_ids.values())
+
+        # The payload already has the track list, no need for a second get_album
+        for browse_id, album_info in album_infos:
+            if browse_id in new_albums:
+                album = new_albums[browse_id]
+                album.id = album_ids[browse_id]
+                ingest_tracks(album, album_info['tracks'], artists=[artist])
+        search.index_objects(new_albums.values())
+
+    metrics.inc('sync_items_created_total', len(new_albums), kind='album')
+    logger.debug(f"Ingested {len(album_infos)} albums for {artist}, {len(new_albums)} new")
+    return len(new_albums)
@@ -0,0 +1,349 @@
+# utils/library_io.py
+"""
+Streaming export and import of the catalog (artists, albums, songs and
+their links) and of users' ratings and favorites as JSON Lines, so a new
+instance can be seeded from another one instead of re-syncing everything
+from YouTube Music.
+
+Every record is one JSON object with a 'type'. Rows refer to each other by
+their YouTube ids (channelId, browseId, videoId) and to users by username,
+never by database id. Both directions work a batch at a time: the export
+reads with iterator() and one lookup query per batch for the links, the
+import groups consecutive records and writes each group with bulk_create,
+so memory stays flat however large the library is.
+"""
+import datetime
+import gzip
+import io
+import itertools
+import json
+import logging
+import sys
+from collections import Counter, defaultdict
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from music_manager.models import (
+    Album, AlbumSong, Artist, RatingSummary, Song, UserFavorite, UserRating, free_slug, slug_base, unique_slug,
+)
+from music_manager.utils import search
+from music_manager.utils.pipeline import batched
+
+logger = logging.getLogger(__name__)
+
+ARTIST_FIELDS = [
+    'channelId', 'name', 'slug', 'bio', 'album_browseId', 'album_params', 'number_of_albums',
+    'singles_browseId', 'singles_params', 'number_of_singles', 'thumbnail_url', 'need_discography',
+    'fingerprint', 'last_synced',
+]
+ALBUM_FIELDS = [
+    'browseId', 'title', 'slug', 'release_year', 'number_of_songs', 'isExplicit', 'thumbnail_url',
+    'label', 'catalog_number', 'album_type', 'need_tracks', 'fingerprint', 'last_synced',
+]
+SONG_FIELDS = ['videoId', 'title', 'slug', 'url', 'duration', 'isrc', 'lyrics', 'composition_date']
+RATING_FIELDS = ['rating', 'is_recommended', 'date_rated', 'last_updated']
+FAVORITE_FIELDS = ['date_favorited']
+
+# Rated/favorited kinds and the YouTube id that identifies them across instances
+CONTENT_KEYS = {
+    'artist': (Artist, 'channelId'),
+    'album': (Album, 'browseId'),
+    'song': (Song, 'videoId'),
+}
+
+
+def open_jsonl(path, mode):
+    """A text stream for path, gzip compressed for *.gz and stdin/stdout for '-'"""
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer if mode == 'r' else sys.stdout.buffer, encoding='utf-8')
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+class RecordEncoder(DjangoJSONEncoder):
+    """Keeps microseconds, which DjangoJSONEncoder cuts to milliseconds"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def write_records(records, stream):
+    count = 0
+    for record in records:
+        stream.write(json.dumps(record, cls=RecordEncoder, ensure_ascii=False))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def read_records(stream):
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {number} is not valid JSON: {e}") from e
+
+
+# -------------------------------
+# Export
+
+def export_records(user_data=True, batch_size=2000):
+    """Every record of the library, in the order LibraryImporter needs them"""
+    yield from _export_artists(batch_size)
+    yield from _export_albums(batch_size)
+    yield from _export_songs(batch_size)
+    if user_data:
+        yield from _export_user_content('rating', UserRating, RATING_FIELDS, batch_size)
+        yield from _export_user_content('favorite', UserFavorite, FAVORITE_FIELDS, batch_size)
+
+
+def _grouped(pairs):
+    grouped = defaultdict(list)
+    for key, value in pairs:
+        grouped[key].append(value)
+    return grouped
+
+
+def _export_artists(batch_size):
+    for row in Artist.objects.order_by('id').values(*ARTIST_FIELDS).iterator(chunk_size=batch_size):
+        yield {'type': 'artist', **row}
+
+
+def _export_albums(batch_size):
+    rows = Album.objects.order_by('id').values('id', *ALBUM_FIELDS).iterator(chunk_size=batch_size)
+    for batch in batched(rows, batch_size):
+        artists = _grouped(Album.artists.through.objects.filter(
+            album_id__in=[row['id'] for row in batch],
+        ).values_list('album_id', 'artist__channelId'))
+        for row in batch:
+            album_id = row.pop('id')
+            yield {'type': 'album', **row, 'artists': artists[album_id]}
+
+
+def _export_songs(batch_size):
+    rows = Song.objects.order_by('id').values('id', *SONG_FIELDS).iterator(chunk_size=batch_size)
+    for batch in batched(rows, batch_size):
+        ids = [row['id'] for row in batch]
+        primary = _grouped(Song.primary_artists.through.objects.filter(
+            song_id__in=ids,
+        ).values_list('song_id', 'artist__channelId'))
+        featured = _grouped(Song.featured_artists.through.objects.filter(
+            song_id__in=ids,
+        ).values_list('song_id', 'artist__channelId'))
+        albums = _grouped(
+            (song_id, [browse_id, track_number, disc_number])
+            for song_id, browse_id, track_number, disc_number in AlbumSong.objects.filter(
+                song_id__in=ids,
+            ).values_list('song_id', 'album__browseId', 'track_number', 'disc_number')
+        )
+        for row in batch:
+            song_id = row.pop('id')
+            yield {
+                'type': 'song', **row,
+                'primary_artists': primary[song_id],
+                'featured_artists': featured[song_id],
+                'albums': albums[song_id],
+            }
+
+
+def _export_user_content(record_type, model, fields, batch_size):
+    kinds = {ContentType.objects.get_for_model(kind_model).id: kind for kind, (kind_model, _) in CONTENT_KEYS.items()}
+    rows = model.objects.filter(content_type_id__in=kinds).order_by('id').values(
+        'user__username', 'content_type_id', 'object_id', *fields,
+    ).iterator(chunk_size=batch_size)
+    for batch in batched(rows, batch_size):
+        keys = {}
+        for content_type_id, kind in kinds.items():
+            kind_model, key_field = CONTENT_KEYS[kind]
+            object_ids = [row['object_id'] for row in batch if row['content_type_id'] == content_type_id]
+            if object_ids:
+                keys[kind] = dict(kind_model.objects.filter(id__in=object_ids).values_list('id', key_field))
+        for row in batch:
+            kind = kinds[row.pop('content_type_id')]
+            key = keys[kind].get(row.pop('object_id'))
+            if key is None:
+                continue  # Points at a deleted object
+            yield {'type': record_type, 'user': row.pop('user__username'), 'kind': kind, 'key': key, **row}
+
+
+# -------------------------------
+# Import
+
+class LibraryImporter:
+    """
+    Writes records from export_records a batch at a time. Rows that already
+    exist (same YouTube id, or same user and object) are left alone, so an
+    interrupted import can simply be run again.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.created = Counter()
+        self.skipped = Counter()
+        self._user_ids = {}
+        self._content_types = {
+            kind: ContentType.objects.get_for_model(model).id for kind, (model, _) in CONTENT_KEYS.items()
+        }
+
+    def run(self, records):
+        handlers = {
+            'artist': self.import_artists,
+            'album': self.import_albums,
+            'song': self.import_songs,
+            'rating': lambda rows: self.import_user_content(UserRating, RATING_FIELDS, rows),
+            'favorite': lambda rows: self.import_user_content(UserFavorite, FAVORITE_FIELDS, rows),
+        }
+        for record_type, group in itertools.groupby(records, key=lambda record: record.get('type')):
+            handler = handlers.get(record_type)
+            for batch in batched(group, self.batch_size):
+                if handler is None:
+                    self.skipped[record_type] += len(batch)
+                    continue
+                with transaction.atomic():
+                    handler(batch)
+
+        # bulk_create skips the signals that keep these up to date
+        if self.created['artist'] or self.created['album'] or self.created['song']:
+            search.rebuild()
+        if self.created['rating']:
+            RatingSummary.rebuild()
+        logger.info(f"Imported {dict(self.created)}, skipped {dict(self.skipped)}")
+        return self.created
+
+    def _new_rows(self, model, key_field, rows):
+        """Rows whose key isn't in the database yet, first occurrence only"""
+        by_key = {}
+        for row in rows:
+            by_key.setdefault(row[key_field], row)
+        existing = set(model.objects.filter(**{f'{key_field}__in': by_key}).values_list(key_field, flat=True))
+        new = [row for key, row in by_key.items() if key not in existing]
+        self.skipped[model._meta.model_name] += len(rows) - len(new)
+        return new
+
+    def _ids(self, model, key_field, keys):
+        return dict(model.objects.filter(**{f'{key_field}__in': set(keys)}).values_list(key_field, 'id'))
+
+    def import_artists(self, rows):
+        rows = self._new_rows(Artist, 'channelId', rows)
+        taken = set(Artist.objects.filter(slug__in=[row.get('slug') for row in rows]).values_list('slug', flat=True))
+        artists = []
+        for row in rows:
+            artist = Artist(**{field: row[field] for field in ARTIST_FIELDS if field in row})
+            # Another artist here may already have the slug
+            if not artist.slug or artist.slug in taken:
+                artist.slug = free_slug(Artist.objects.all(), slug_base(artist.name, artist.channelId), taken)
+            taken.add(artist.slug)
+            artists.append(artist)
+        Artist.objects.bulk_create(artists)
+        self.created['artist'] += len(artists)
+
+    def import_albums(self, rows):
+        rows = self._new_rows(Album, 'browseId', rows)
+        artist_ids = self._ids(Artist, 'channelId', [key for row in rows for key in row.get('artists', [])])
+
+        # Album slugs are unique per artist, an artist here may already have an album with the slug
+        taken = defaultdict(set)
+        for artist_id, slug in Album.objects.filter(artists__in=artist_ids.values()).values_list('artists', 'slug'):
+            taken[artist_id].add(slug)
+        albums = []
+        for row in rows:
+            album = Album(**{field: row[field] for field in ALBUM_FIELDS if field in row})
+            album_artists = [artist_ids[key] for key in row.get('artists', []) if key in artist_ids]
+            used = set().union(*(taken[artist_id] for artist_id in album_artists))
+            if not album.slug or album.slug in used:
+                album.slug = unique_slug(slug_base(album.title, album.browseId), used)
+            for artist_id in album_artists:
+                taken[artist_id].add(album.slug)
+            albums.append(album)
+        Album.objects.bulk_create(albums)
+        album_ids = self._ids(Album, 'browseId', [row['browseId'] for row in rows])
+
+        AlbumArtist = Album.artists.through
+        AlbumArtist.objects.bulk_create([
+            AlbumArtist(album_id=album_ids[row['browseId']], artist_id=artist_ids[key])
+            for row in rows
+            for key in row.get('artists', [])
+            if key in artist_ids
+        ], ignore_conflicts=True)
+        self.created['album'] += len(rows)
+
+    def import_songs(self, rows):
+        rows = self._new_rows(Song, 'videoId', rows)
+        Song.objects.bulk_create([
+            Song(**{field: row[field] for field in SONG_FIELDS if field in row})
+            for row in rows
+        ])
+        song_ids = self._ids(Song, 'videoId', [row['videoId'] for row in rows])
+        artist_ids = self._ids(Artist, 'channelId', [
+            key for row in rows for key in row.get('primary_artists', []) + row.get('featured_artists', [])
+        ])
+        album_ids = self._ids(Album, 'browseId', [album[0] for row in rows for album in row.get('albums', [])])
+
+        AlbumSong.objects.bulk_create([
+            AlbumSong(
+                album_id=album_ids[browse_id], song_id=song_ids[row['videoId']],
+                track_number=track_number, disc_number=disc_number,
+            )
+            for row in rows
+            for browse_id, track_number, disc_number in row.get('albums', [])
+            if browse_id in album_ids
+        ], ignore_conflicts=True)
+        for relation in ('primary_artists', 'featured_artists'):
+            through = getattr(Song, relation).through
+            through.objects.bulk_create([
+                through(song_id=song_ids[row['videoId']], artist_id=artist_ids[key])
+                for row in rows
+                for key in row.get(relation, [])
+                if key in artist_ids
+            ], ignore_conflicts=True)
+        self.created['song'] += len(rows)
+
+    def _user_id(self, username):
+        if username not in self._user_ids:
+            self._user_ids[username] = User.objects.filter(username=username).values_list('id', flat=True).first()
+            if self._user_ids[username] is None:
+                logger.warning(f"No user {username!r}, skipping their ratings and favorites")
+        return self._user_ids[username]
+
+    def import_user_content(self, model, fields, rows):
+        record_type = 'rating' if model is UserRating else 'favorite'
+        object_ids = {
+            kind: self._ids(kind_model, key_field, [row['key'] for row in rows if row.get('kind') == kind])
+            for kind, (kind_model, key_field) in CONTENT_KEYS.items()
+        }
+        wanted = {}
+        for row in rows:
+            user_id = self._user_id(row.get('user'))
+            object_id = object_ids.get(row.get('kind'), {}).get(row.get('key'))
+            if user_id is not None and object_id is not None:
+                wanted.setdefault((user_id, self._content_types[row['kind']], object_id), row)
+
+        existing = set(model.objects.filter(
+            user_id__in={user_id for user_id, _, _ in wanted},
+            object_id__in={object_id for _, _, object_id in wanted},
+        ).values_list('user_id', 'content_type_id', 'object_id'))
+        new = [(key, row) for key, row in wanted.items() if key not in existing]
+        self.skipped[record_type] += len(rows) - len(new)
+
+        objects = model.objects.bulk_create([
+            model(user_id=user_id, content_type_id=content_type_id, object_id=object_id,
+                  **{field: row[field] for field in fields if field in row})
+            for (user_id, content_type_id, object_id), row in new
+        ])
+        # auto_now_add replaced the exported dates on insert, bulk_update writes them back
+        if objects and all(obj.pk is not None for obj in objects):
+            for obj, (_, row) in zip(objects, new):
+                for field in fields:
+                    if field in row:
+                        setattr(obj, field, row[field])
+            model.objects.bulk_update(objects, [field for field in fields if field in new[0][1]])
+        self.created[record_type] += len(objects)
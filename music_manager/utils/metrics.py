@@ -0,0 +1,261 @@
+# utils/metrics.py
+"""
+Counters and latency histograms for YouTube Music calls and sync steps,
+exposed in the Prometheus text format by views.metrics.
+
+The web server and the sync worker are separate processes, so every
+process keeps its own registry and writes it to a JSON file in METRICS_DIR
+at most every METRICS_FLUSH_INTERVAL seconds, like prometheus_client's
+multiprocess mode. The metrics view adds up every process's file.
+
+Files are named by host, PID and a random token, so a reused PID never
+takes over an old file. collect() deletes the files of processes on this
+host that have exited, and any file not written for METRICS_MAX_AGE
+seconds (from other hosts, or idle ones). A deleted file's counters drop
+out of the sums, which Prometheus treats as a counter reset.
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# name -> (type, help)
+DEFINITIONS = {
+    'ytmusic_request_seconds': (
+        'histogram', "Time spent in ytmusicapi calls that reached YouTube Music, by endpoint and outcome",
+    ),
+    'ytmusic_cache_requests_total': (
+        'counter', "Calls to cached endpoints, by whether the response cache answered them",
+    ),
+    'ytmusic_retries_total': ('counter', "Throttled ytmusicapi calls that were retried"),
+    'ytmusic_ratelimit_wait_seconds_total': ('counter', "Time calls spent waiting for the shared rate limiter"),
+    'sync_step_seconds': ('histogram', "Duration of sync and ingestion steps, by step and outcome"),
+    'sync_job_seconds': ('histogram', "Duration of finished sync jobs, by kind and status"),
+    'sync_items_created_total': ('counter', "Albums and songs created by syncs"),
+}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+class Registry:
+    """Thread safe counters and fixed-bucket histograms keyed by name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}  # key -> [count per bucket..., count above the last bucket, sum]
+        self._flushed = time.monotonic()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+        self.flush()
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            counts = self._histograms.setdefault(_key(name, labels), [0] * (len(BUCKETS) + 1) + [0.0])
+            index = next((i for i, bound in enumerate(BUCKETS) if value <= bound), len(BUCKETS))
+            counts[index] += 1
+            counts[-1] += value
+        self.flush()
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, dict(labels), list(counts)] for (name, labels), counts in self._histograms.items()],
+            }
+
+    def flush(self, force=False):
+        """Write this process's metrics to METRICS_DIR, unless that was done recently"""
+        if not settings.METRICS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self._flushed = now
+        snapshot = self.snapshot()
+        if not snapshot['counters'] and not snapshot['histograms']:
+            # Nothing happened in this process (e.g. a management command), leave no file behind
+            return
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=settings.METRICS_DIR, suffix='.part')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, os.path.join(settings.METRICS_DIR, process_filename()))
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {settings.METRICS_DIR}: {e}")
+
+
+_identity = None  # (pid, token) of this process, new after a fork
+
+
+def process_filename():
+    global _identity
+    pid = os.getpid()
+    if _identity is None or _identity[0] != pid:
+        _identity = (pid, uuid.uuid4().hex[:8])
+    return f'{socket.gethostname()}-{pid}-{_identity[1]}.json'
+
+
+def _is_stale(path, filename):
+    """Whether a process file belongs to an exited local process or hasn't been written in METRICS_MAX_AGE"""
+    try:
+        host, pid, _ = filename[:-len('.json')].rsplit('-', 2)
+        if host == socket.gethostname():
+            os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (ValueError, PermissionError):
+        pass  # Not our naming (left for the age check), or alive under another user
+    return time.time() - os.path.getmtime(path) > settings.METRICS_MAX_AGE
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+@contextmanager
+def timed(name, **labels):
+    """Observe how long the block takes, labelled outcome=ok or outcome=error"""
+    start = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe(name, elapsed, outcome=outcome, **labels)
+        logger.debug(
+            f"{name} {' '.join(f'{label}={value}' for label, value in labels.items())} "
+            f"outcome={outcome} duration_ms={elapsed * 1000:.1f}",
+            extra={'metric': name, **labels, 'outcome': outcome, 'duration_ms': round(elapsed * 1000, 1)},
+        )
+
+
+class InstrumentedClient:
+    """
+    Wraps a YTMusic client so every API call is timed. It sits inside the
+    rate limiter, so each retry is its own observation and cached responses
+    never get here.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with timed('ytmusic_request_seconds', endpoint=name):
+                return attr(*args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+def collect():
+    """Every process's metrics added together, as a snapshot() shaped dict"""
+    snapshots = [registry.snapshot()]
+    if settings.METRICS_DIR:
+        registry.flush(force=True)
+        own = process_filename()
+        try:
+            filenames = [name for name in os.listdir(settings.METRICS_DIR) if name.endswith('.json') and name != own]
+        except FileNotFoundError:
+            filenames = []
+        for filename in filenames:
+            path = os.path.join(settings.METRICS_DIR, filename)
+            try:
+                if _is_stale(path, filename):
+                    os.remove(path)
+                    logger.info(f"Removed the metrics file of a finished process: {filename}")
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.debug(f"Skipping metrics file {filename}: {e}")
+
+    counters = defaultdict(float)
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[_key(name, labels)] += value
+        for name, labels, counts in snapshot['histograms']:
+            total = histograms.setdefault(_key(name, labels), [0] * len(counts))
+            for i, count in enumerate(counts):
+                total[i] += count
+    return {
+        'counters': [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, dict(labels), counts] for (name, labels), counts in histograms.items()],
+    }
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{label}="{_escape(value)}"' for label, value in sorted(labels.items())) + '}'
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(snapshot=None):
+    """The Prometheus text exposition of collect()"""
+    snapshot = snapshot or collect()
+    series = defaultdict(list)
+    for name, labels, value in sorted(snapshot['counters'], key=lambda row: (row[0], sorted(row[1].items()))):
+        series[name].append(f'{name}{_labels(labels)} {_number(value)}')
+    for name, labels, counts in sorted(snapshot['histograms'], key=lambda row: (row[0], sorted(row[1].items()))):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), counts[:-1]):
+            cumulative += count
+            series[name].append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+        series[name].append(f'{name}_sum{_labels(labels)} {_number(counts[-1])}')
+        series[name].append(f'{name}_count{_labels(labels)} {cumulative}')
+
+    lines = []
+    for name in sorted(series):
+        metric_type, help_text = DEFINITIONS.get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(series[name])
+    return '\n'.join(lines) + '\n'
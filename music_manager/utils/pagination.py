@@ -0,0 +1,93 @@
+# utils/pagination.py
+"""
+Keyset (seek) pagination. Instead of OFFSET, each page filters on the sort
+key of the last row already shown, so the database seeks straight to the
+next row through the ordering index no matter how deep the page is.
+
+Cursors come back in URLs, so one that doesn't decode to key values of the
+right shape and types raises InvalidCursor, which Django answers with a 400.
+"""
+import base64
+import json
+import logging
+
+from django.conf import settings
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+# What encode_cursor can produce from a model field's value
+CURSOR_TYPES = (str, int, float, type(None))
+
+
+class InvalidCursor(BadRequest):
+    pass
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor, length):
+    """Return the key values in a cursor, None if there is none. Raises InvalidCursor if it is malformed."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError as e:
+        raise InvalidCursor(f"Malformed page cursor: {e}") from e
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(f"Page cursor must hold {length} values")
+    if not all(isinstance(value, CURSOR_TYPES) for value in values):
+        raise InvalidCursor("Page cursor values must be strings, numbers or null")
+    return values
+
+
+def page_size(requested=None):
+    """The requested page size, capped at LIBRARY_MAX_PAGE_SIZE"""
+    try:
+        size = int(requested or settings.LIBRARY_PAGE_SIZE)
+    except ValueError:
+        size = settings.LIBRARY_PAGE_SIZE
+    return max(1, min(size, settings.LIBRARY_MAX_PAGE_SIZE))
+
+
+def seek_filter(ordering, values):
+    """
+    Rows that sort after `values` under `ordering`, i.e.
+    (a > x) OR (a = x AND b > y) OR ... with < for descending fields.
+    The last field must be unique so ties never repeat or skip rows.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, size=None):
+    """
+    One page of queryset sorted by ordering. Returns (items, next_cursor),
+    next_cursor is None on the last page. At most size + 1 rows are fetched.
+    """
+    size = page_size(size)
+    queryset = queryset.order_by(*ordering)
+    values = decode_cursor(cursor, len(ordering))
+    if values is not None:
+        try:
+            queryset = queryset.filter(seek_filter(ordering, values))
+        except (TypeError, ValueError, ValidationError) as e:
+            # e.g. a string where the key is an id
+            raise InvalidCursor(f"Page cursor doesn't match the ordering: {e}") from e
+
+    items = list(queryset[:size + 1])
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip('-')) for field in ordering])
+    return items, next_cursor
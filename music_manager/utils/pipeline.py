@@ -0,0 +1,62 @@
+# utils/pipeline.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    The process wide pool used for YouTube Music fetches. Sharing one pool
+    caps the number of calls in flight no matter how many syncs are running.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.YTMUSIC_MAX_WORKERS,
+                thread_name_prefix='ytmusic-fetch',
+            )
+        return _executor
+
+
+def fetch_concurrently(fetch, keys):
+    """
+    Call fetch(key) for every key on the shared pool and yield (key, result)
+    pairs as they complete.
+
+    Only the API calls run on the pool; the caller consumes the results and
+    is the single thread that writes them to the database. If a fetch fails
+    the remaining ones are cancelled and the error is raised to the caller.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+
+    executor = get_executor()
+    futures = {executor.submit(fetch, key): key for key in keys}
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def batched(iterable, size=None):
+    """Group an iterable into lists of at most size items"""
+    size = size or settings.YTMUSIC_WRITE_BATCH
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
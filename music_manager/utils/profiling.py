@@ -0,0 +1,268 @@
+# utils/profiling.py
+"""
+Per request query profiling and query budgets.
+
+QueryProfileMiddleware counts the queries a request runs, their total time,
+the slowest statements and the time spent rendering templates (measured by
+the ProfilingTemplates backend). It logs them, adds Server-Timing headers
+with QUERY_PROFILE_HEADERS, and checks the count against the view's budget
+in QUERY_BUDGETS. A request over budget is logged as a warning, or raises
+QueryBudgetExceeded with QUERY_BUDGET_STRICT so test suites fail on N+1
+regressions. query_budget() does the same check around any block.
+
+Template time includes queries run by lazy querysets in the templates, so
+the two overlap.
+
+Queries are recorded by an execute wrapper on every connection, into the
+profiles active in the context that ran them. Under ASGI the queries of an
+async view run on sync_to_async threads with the request's context, so
+they count towards that request and not to others sharing the thread.
+"""
+import heapq
+import itertools
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+_active = ContextVar('query_profile', default=None)
+_placeholders = re.compile(r'\((?:%s, )+%s\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize_sql(sql):
+    """Statements differing only in the length of an IN (...) list count as the same"""
+    return _placeholders.sub('(%s, ...)', sql)
+
+
+def record_queries(execute, sql, params, many, context):
+    """Execute wrapper timing a statement for the active profile and the ones around it"""
+    profile = _active.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        while profile is not None:
+            profile._record(sql, elapsed)
+            profile = profile._outer
+
+
+def install(connection):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+@receiver(connection_created, dispatch_uid='query_profile')
+def install_on_new_connection(sender, connection, **kwargs):
+    # Connections are per thread, this covers those of sync_to_async threads too
+    install(connection)
+
+
+class QueryProfile:
+    """Context manager recording the queries of every database connection and template render time"""
+
+    def __init__(self, keep=3):
+        self.keep = keep
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.seconds = 0.0
+        self.statements = Counter()
+        self._slowest = []  # heap of (seconds, tiebreak, sql)
+        self._order = itertools.count()
+        self._rendering = 0
+        self._outer = None
+
+    def __enter__(self):
+        # Connections opened before this module was imported missed install_on_new_connection
+        for connection in connections.all():
+            install(connection)
+        self._outer = _active.get()
+        self._token = _active.set(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        _active.reset(self._token)
+        # Renders are only timed by the innermost profile, pass them on to the one around it
+        outer = _active.get()
+        if outer is not None and not outer._rendering:
+            outer.template_seconds += self.template_seconds
+
+    def _record(self, sql, elapsed):
+        self.queries += 1
+        self.db_seconds += elapsed
+        self.statements[normalize_sql(sql)] += 1
+        entry = (elapsed, next(self._order), sql)
+        if len(self._slowest) < self.keep:
+            heapq.heappush(self._slowest, entry)
+        else:
+            heapq.heappushpop(self._slowest, entry)
+
+    @property
+    def slowest(self):
+        """[(milliseconds, sql)] of the slowest statements, slowest first"""
+        return [(round(seconds * 1000, 2), sql) for seconds, _, sql in sorted(self._slowest, reverse=True)]
+
+    def repeated(self, minimum=2):
+        """[(count, sql)] of statements run more than once, the usual sign of an N+1"""
+        return [(count, sql) for sql, count in self.statements.most_common() if count >= minimum]
+
+    def summary(self):
+        return (
+            f"{self.queries} queries in {self.db_seconds * 1000:.1f}ms, "
+            f"templates {self.template_seconds * 1000:.1f}ms, total {self.seconds * 1000:.1f}ms"
+        )
+
+    def check(self, budget, label='block'):
+        """Raise QueryBudgetExceeded if more than budget queries ran"""
+        if budget is None or self.queries <= budget:
+            return
+        lines = [f"{label} ran {self.queries} queries, over its budget of {budget}"]
+        lines.extend(f"  {count}x {sql}" for count, sql in self.repeated()[:5])
+        raise QueryBudgetExceeded('\n'.join(lines))
+
+
+@contextmanager
+def query_budget(budget, keep=3):
+    """
+    Fail when the block runs more queries than budget, which may be a
+    number or the view name of a QUERY_BUDGETS entry, e.g.
+
+        with query_budget('music_manager:manage_likes'):
+            client.get(reverse('music_manager:manage_likes'))
+    """
+    label = 'block'
+    if isinstance(budget, str):
+        label, budget = budget, budget_for(budget)
+    with QueryProfile(keep=keep) as profile:
+        yield profile
+    profile.check(budget, label)
+
+
+def budget_for(view_name):
+    return settings.QUERY_BUDGETS.get(view_name, settings.QUERY_BUDGET_DEFAULT)
+
+
+class ProfiledTemplate(Template):
+    def render(self, context=None, request=None):
+        profile = _active.get()
+        if profile is None or profile._rendering:
+            # render_to_string inside a template is already part of the outer render
+            return super().render(context, request)
+        profile._rendering += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            profile.template_seconds += time.perf_counter() - start
+            profile._rendering -= 1
+
+
+class ProfilingTemplates(DjangoTemplates):
+    """The Django template backend, timing renders that happen inside a QueryProfile"""
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
+
+
+class QueryProfileMiddleware:
+    """
+    Profile every request, see the module docstring. Goes first so session
+    and auth queries count too. Sync and async capable, so being first
+    doesn't make Django run async views on a thread under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.QUERY_PROFILE_ENABLED:
+            return self.get_response(request)
+
+        with QueryProfile(keep=settings.QUERY_PROFILE_SLOWEST) as profile:
+            response = self.get_response(request)
+        return self.report(request, response, profile)
+
+    async def __acall__(self, request):
+        if not settings.QUERY_PROFILE_ENABLED:
+            return await self.get_response(request)
+
+        with QueryProfile(keep=settings.QUERY_PROFILE_SLOWEST) as profile:
+            response = await self.get_response(request)
+        return self.report(request, response, profile)
+
+    def report(self, request, response, profile):
+        """Log the profile, add its headers and enforce the view's budget"""
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        budget = budget_for(view_name) if view_name else None
+        over_budget = budget is not None and profile.queries > budget
+
+        if settings.QUERY_PROFILE_HEADERS:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={profile.db_seconds * 1000:.1f};desc="{profile.queries} queries"',
+                f'template;dur={profile.template_seconds * 1000:.1f}',
+                f'total;dur={profile.seconds * 1000:.1f}',
+            ])
+            response['X-Query-Count'] = str(profile.queries)
+            if budget is not None:
+                response['X-Query-Budget'] = str(budget)
+
+        slowest = profile.slowest
+        slow = bool(slowest) and slowest[0][0] >= settings.QUERY_PROFILE_SLOW_MS
+        extra = {
+            'view': view_name,
+            'path': request.path,
+            'queries': profile.queries,
+            'query_budget': budget,
+            'db_ms': round(profile.db_seconds * 1000, 1),
+            'template_ms': round(profile.template_seconds * 1000, 1),
+            'duration_ms': round(profile.seconds * 1000, 1),
+            'slowest_sql': slowest,
+        }
+        message = f"{request.method} {request.path} ({view_name}): {profile.summary()}"
+        if over_budget or slow:
+            details = [message]
+            if over_budget:
+                details.append(f"over the query budget of {budget}")
+                repeated = profile.repeated()[:3]
+                if repeated:
+                    details.append("most repeated:")
+                    details.extend(f"  {count}x {sql}" for count, sql in repeated)
+            details.append("slowest:")
+            details.extend(f"  {ms}ms {sql}" for ms, sql in slowest)
+            logger.warning('\n'.join(details), extra=extra)
+        else:
+            logger.debug(message, extra=extra)
+
+        if over_budget and settings.QUERY_BUDGET_STRICT:
+            profile.check(budget, view_name)
+        return response
@@ -0,0 +1,150 @@
+# utils/ratelimit.py
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from requests.exceptions import ConnectionError, Timeout
+from ytmusicapi.exceptions import YTMusicServerError
+
+from music_manager.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# ytmusicapi only reports the status code inside the exception message
+_STATUS_RE = re.compile(r"HTTP (\d{3})")
+
+
+def is_throttle_error(error):
+    """True for errors that mean YouTube Music wants us to slow down"""
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    if isinstance(error, YTMusicServerError):
+        match = _STATUS_RE.search(str(error))
+        if match:
+            status = int(match.group(1))
+            return status == 429 or status >= 500
+    return False
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate follows AIMD: every healthy response adds
+    a little to the rate, every throttled one cuts it by a factor.
+    """
+
+    def __init__(self, initial_rate, min_rate, max_rate, burst=1, increase=0.1, decrease=0.5):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self._rate = initial_rate
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.throttled = 0
+
+    @property
+    def rate(self):
+        """Current allowed requests per second"""
+        return self._rate
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.calls += 1
+                    break
+                wait = (1 - self._tokens) / self._rate
+            time.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.inc('ytmusic_ratelimit_wait_seconds_total', waited)
+
+    def success(self):
+        with self._lock:
+            self._rate = min(self.max_rate, self._rate + self.increase)
+
+    def throttle(self):
+        with self._lock:
+            self._rate = max(self.min_rate, self._rate * self.decrease)
+            # Drop any saved up burst so the slower rate applies straight away
+            self._tokens = min(self._tokens, 0)
+            self.throttled += 1
+        logger.warning(f"YouTube Music throttled us, rate lowered to {self._rate:.2f}/s")
+
+    def stats(self):
+        return {
+            'rate': round(self._rate, 3),
+            'calls': self.calls,
+            'throttled': self.throttled,
+        }
+
+
+class RateLimitedClient:
+    """
+    Wraps a YTMusic client so every API method waits for the shared limiter
+    and retries throttled responses. Non-callable attributes pass straight through.
+    """
+
+    def __init__(self, client, limiter, max_retries=None):
+        self._client = client
+        self._limiter = limiter
+        self._max_retries = settings.YTMUSIC_MAX_RETRIES if max_retries is None else max_retries
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            attempt = 0
+            while True:
+                self._limiter.acquire()
+                try:
+                    result = attr(*args, **kwargs)
+                except Exception as e:
+                    if not is_throttle_error(e) or attempt >= self._max_retries:
+                        raise
+                    self._limiter.throttle()
+                    attempt += 1
+                    metrics.inc('ytmusic_retries_total', endpoint=name)
+                    logger.info(f"Retrying {name} (attempt {attempt}) after: {e}")
+                    continue
+                self._limiter.success()
+                return result
+
+        call.__name__ = name
+        return call
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """The process wide limiter shared by every YTMusic client"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveRateLimiter(
+                initial_rate=settings.YTMUSIC_RATE_INITIAL,
+                min_rate=settings.YTMUSIC_RATE_MIN,
+                max_rate=settings.YTMUSIC_RATE_MAX,
+                burst=settings.YTMUSIC_RATE_BURST,
+                increase=settings.YTMUSIC_RATE_INCREASE,
+                decrease=settings.YTMUSIC_RATE_DECREASE,
+            )
+        return _limiter
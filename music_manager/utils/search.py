@@ -0,0 +1,321 @@
+# utils/search.py
+"""
+Full-text search over artist names and bios, album titles and song titles
+and lyrics. On SQLite the index is an FTS5 table next to the app's tables;
+on other databases, or a SQLite built without FTS5, an inverted index is
+kept in memory instead. Both are updated by the save/delete signals and
+the bulk ingest functions, and can be rebuilt with rebuild_search_index.
+
+The in-memory index belongs to one process, so it only sees writes made
+by other processes (e.g. the sync worker) by polling: every
+SEARCH_MEMORY_REFRESH seconds it indexes rows newer than the ones it has.
+Edits and deletes made elsewhere only show up after a restart.
+"""
+import bisect
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+from music_manager.models import Album, Artist, Song
+
+logger = logging.getLogger(__name__)
+
+# Each kind's code is folded into the FTS rowid so a row is updated through the rowid index
+KINDS = {
+    'artist': (0, Artist, 'name', 'bio'),
+    'album': (1, Album, 'title', None),
+    'song': (2, Song, 'title', 'lyrics'),
+}
+KIND_BY_CODE = {code: kind for kind, (code, *_) in KINDS.items()}
+KIND_BY_MODEL = {model: kind for kind, (_, model, *_) in KINDS.items()}
+
+TABLE = 'music_manager_search'
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return [token.lower() for token in _TOKEN.findall(text or '')]
+
+
+def document(obj):
+    """(kind, object id, title, body) of an indexed model instance"""
+    kind = KIND_BY_MODEL[type(obj)]
+    _, _, title_field, body_field = KINDS[kind]
+    title = getattr(obj, title_field) or ''
+    body = (getattr(obj, body_field) or '') if body_field else ''
+    return kind, obj.pk, title, body
+
+
+def iter_documents(batch_size=2000):
+    for kind, (_, model, title_field, body_field) in KINDS.items():
+        fields = ['pk', title_field] + ([body_field] if body_field else [])
+        for row in model.objects.values_list(*fields).order_by('pk').iterator(chunk_size=batch_size):
+            yield kind, row[0], row[1] or '', (row[2] or '') if body_field else ''
+
+
+class FTS5Index:
+    """Search backed by an SQLite FTS5 table with prefix indexes for typeahead"""
+
+    def __init__(self):
+        self._created_in = None  # Name of the database the table was made in
+
+    def _rowid(self, kind, object_id):
+        return object_id * len(KINDS) + KINDS[kind][0]
+
+    def ensure_table(self):
+        # Once per process and database (tests and benchmarks switch to a test database)
+        database = connection.settings_dict['NAME']
+        if self._created_in == database:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+                "title, body, tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')"
+            )
+        self._created_in = database
+
+    def add(self, documents):
+        rows = [(self._rowid(kind, object_id), title, body) for kind, object_id, title, body in documents]
+        if rows:
+            with connection.cursor() as cursor:
+                cursor.executemany(f"INSERT OR REPLACE INTO {TABLE} (rowid, title, body) VALUES (%s, %s, %s)", rows)
+
+    def remove(self, kind, object_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [self._rowid(kind, object_id)])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE}")
+
+    @staticmethod
+    def _match(tokens, column=None):
+        # Quoted so user input can't use FTS syntax, the last token matches as a prefix
+        terms = [f'"{token}"' for token in tokens[:-1]] + [f'"{tokens[-1]}"*']
+        query = ' '.join(terms)
+        return f'{column} : ({query})' if column else query
+
+    def _query(self, match, kinds, limit, ranked=True):
+        sql = f"SELECT rowid, title FROM {TABLE} WHERE {TABLE} MATCH %s"
+        params = [match]
+        if kinds:
+            codes = [KINDS[kind][0] for kind in kinds]
+            sql += f" AND rowid %% {len(KINDS)} IN ({', '.join(['%s'] * len(codes))})"
+            params += codes
+        if ranked:
+            sql += " ORDER BY rank"
+        sql += " LIMIT %s"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, limit])
+            rows = cursor.fetchall()
+        return [(KIND_BY_CODE[rowid % len(KINDS)], rowid // len(KINDS), title) for rowid, title in rows]
+
+    def search(self, tokens, kinds=None, limit=20):
+        return self._query(self._match(tokens), kinds, limit)
+
+    def typeahead(self, tokens, kinds=None, limit=10):
+        # Unranked so a short prefix stops at the first matches instead of scoring thousands
+        return self._query(self._match(tokens, column='title'), kinds, limit, ranked=False)
+
+
+class InvertedIndex:
+    """
+    In-process fallback: token -> documents postings plus a sorted token
+    list, so a prefix is a bisect over the vocabulary. Each process keeps
+    its own copy, built from the database on first use and caught up with
+    new rows every SEARCH_MEMORY_REFRESH seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # One thread builds or catches up, the others wait for it
+        self._checked = 0.0
+        self.newest = {}  # kind -> highest object id indexed from the database
+        self._postings = defaultdict(set)  # token -> {(kind, id)}
+        self._title_postings = defaultdict(set)
+        self._vocabulary = []
+        self._title_vocabulary = []
+        self._sorted = True
+        self._documents = {}  # (kind, id) -> (title, title tokens, all tokens)
+        self.loaded = False
+
+    def ensure_table(self):
+        if self.loaded and time.monotonic() - self._checked < settings.SEARCH_MEMORY_REFRESH:
+            return
+        with self._load_lock:
+            if not self.loaded:
+                rebuild()
+            elif time.monotonic() - self._checked >= settings.SEARCH_MEMORY_REFRESH:
+                self.catch_up()
+            self._checked = time.monotonic()
+
+    def catch_up(self):
+        """Index rows other processes created since the index was built"""
+        documents = []
+        for kind, (_, model, title_field, body_field) in KINDS.items():
+            fields = ['pk', title_field] + ([body_field] if body_field else [])
+            rows = model.objects.filter(pk__gt=self.newest.get(kind, 0)).values_list(*fields).order_by('pk')
+            for row in rows:
+                documents.append((kind, row[0], row[1] or '', (row[2] or '') if body_field else ''))
+                self.newest[kind] = row[0]
+        self.add(documents)
+        if documents:
+            logger.debug(f"Caught up the search index with {len(documents)} new rows")
+
+    def add(self, documents):
+        with self._lock:
+            for kind, object_id, title, body in documents:
+                key = (kind, object_id)
+                self._remove(key)
+                title_tokens = set(tokenize(title))
+                tokens = title_tokens | set(tokenize(body))
+                self._documents[key] = (title, title_tokens, tokens)
+                for token in tokens:
+                    self._postings[token].add(key)
+                for token in title_tokens:
+                    self._title_postings[token].add(key)
+            # Re-sorted once on the next query rather than inserting token by token
+            self._sorted = False
+
+    def _remove(self, key):
+        document = self._documents.pop(key, None)
+        if document is None:
+            return
+        _, title_tokens, tokens = document
+        for postings, removed in ((self._postings, tokens), (self._title_postings, title_tokens)):
+            for token in removed:
+                postings[token].discard(key)
+                if not postings[token]:
+                    del postings[token]
+                    self._sorted = False
+
+    def remove(self, kind, object_id):
+        with self._lock:
+            self._remove((kind, object_id))
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._title_postings.clear()
+            self._vocabulary = []
+            self._title_vocabulary = []
+            self._documents.clear()
+
+    def _prefix(self, vocabulary, postings, prefix):
+        matches = set()
+        position = bisect.bisect_left(vocabulary, prefix)
+        while position < len(vocabulary) and vocabulary[position].startswith(prefix):
+            matches |= postings[vocabulary[position]]
+            position += 1
+        return matches
+
+    def _query(self, tokens, title_only, kinds, limit):
+        with self._lock:
+            if not self._sorted:
+                self._vocabulary = sorted(self._postings)
+                self._title_vocabulary = sorted(self._title_postings)
+                self._sorted = True
+            if title_only:
+                vocabulary, postings = self._title_vocabulary, self._title_postings
+            else:
+                vocabulary, postings = self._vocabulary, self._postings
+
+            matches = self._prefix(vocabulary, postings, tokens[-1])
+            for token in tokens[:-1]:
+                matches &= postings.get(token, set())
+            if kinds:
+                matches = {key for key in matches if key[0] in kinds}
+            # Titles that contain every query token in full rank first, then the shortest titles
+            wanted = set(tokens)
+            ranked = heapq.nsmallest(
+                limit,
+                matches,
+                key=lambda key: (not wanted <= self._documents[key][1], len(self._documents[key][0]), key),
+            )
+            return [(kind, object_id, self._documents[(kind, object_id)][0]) for kind, object_id in ranked]
+
+    def search(self, tokens, kinds=None, limit=20):
+        return self._query(tokens, False, kinds, limit)
+
+    def typeahead(self, tokens, kinds=None, limit=10):
+        return self._query(tokens, True, kinds, limit)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    The process wide search index. FTS5 is used on SQLite unless
+    SEARCH_BACKEND is 'memory' or the SQLite build lacks it.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = InvertedIndex()
+            if settings.SEARCH_BACKEND != 'memory' and connection.vendor == 'sqlite':
+                fts = FTS5Index()
+                try:
+                    fts.ensure_table()
+                    _index = fts
+                except OperationalError as e:
+                    logger.warning(f"FTS5 unavailable, using the in-memory search index: {e}")
+        index = _index
+    index.ensure_table()
+    return index
+
+
+def rebuild(batch_size=2000):
+    """Re-index every artist, album and song. Returns the number of documents indexed."""
+    index = _index if isinstance(_index, InvertedIndex) else get_index()
+    count = 0
+    newest = {}
+    with transaction.atomic():
+        index.clear()
+        batch = []
+        for doc in iter_documents(batch_size):
+            batch.append(doc)
+            newest[doc[0]] = doc[1]  # iter_documents goes in pk order
+            if len(batch) >= batch_size:
+                index.add(batch)
+                count += len(batch)
+                batch = []
+        index.add(batch)
+        count += len(batch)
+    if isinstance(index, InvertedIndex):
+        index.newest = newest
+        index.loaded = True
+    logger.info(f"Indexed {count} artists, albums and songs for search")
+    return count
+
+
+def index_objects(objects):
+    """Add or refresh artists, albums or songs in the search index"""
+    get_index().add([document(obj) for obj in objects])
+
+
+def remove_object(obj):
+    get_index().remove(KIND_BY_MODEL[type(obj)], obj.pk)
+
+
+def search(query, kinds=None, limit=20):
+    """[(kind, id, title)] best matches first, every word must match and the last may be a prefix"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    return get_index().search(tokens, kinds, limit)
+
+
+def typeahead(query, kinds=None, limit=10):
+    """Like search() but only matches titles/names, for search-as-you-type"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    return get_index().typeahead(tokens, kinds, limit)
@@ -0,0 +1,232 @@
+# utils/sync.py
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from music_manager.models import Album, Artist, SyncJob, SyncTask, YtmusicAuth, YTMusicAuthError
+from music_manager.utils import covers, metrics
+from music_manager.utils.ratelimit import get_rate_limiter
+from music_manager.utils.ytmusic import get_user_ytmusic_client
+
+logger = logging.getLogger(__name__)
+
+
+def recover_interrupted():
+    """
+    Put jobs and tasks left running by a dead worker back in the queue so
+    they resume from the first unfinished task
+    """
+    tasks = SyncTask.objects.filter(status=SyncTask.STATUS_RUNNING).update(status=SyncTask.STATUS_PENDING)
+    jobs = SyncJob.objects.filter(status=SyncJob.STATUS_RUNNING).update(status=SyncJob.STATUS_PENDING)
+    if jobs or tasks:
+        logger.info(f"Recovered {jobs} interrupted sync jobs and {tasks} tasks")
+
+
+def claim_next_job(kinds=None):
+    """
+    Atomically claim the oldest pending job, preferring priority kinds.
+    Returns None when the queue is empty.
+    """
+    pending = SyncJob.objects.filter(status=SyncJob.STATUS_PENDING)
+    if kinds is not None:
+        pending = pending.filter(kind__in=kinds)
+    while True:
+        job = (pending.filter(kind__in=SyncJob.PRIORITY_KINDS).order_by('created_at').first()
+               or pending.order_by('created_at').first())
+        if job is None:
+            return None
+        claimed = SyncJob.objects.filter(id=job.id, status=SyncJob.STATUS_PENDING).update(
+            status=SyncJob.STATUS_RUNNING,
+            started_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+        if claimed:
+            return SyncJob.objects.select_related('user').get(id=job.id)
+        # Another worker got there first, try the next one
+
+
+def plan_tasks(job, ytmusic_client):
+    """Create the job's tasks the first time it runs; resumed jobs keep theirs"""
+    if job.tasks.exists() or job.kind == SyncJob.KIND_ALBUM:
+        # Requested album jobs are given their tasks when they are queued
+        return
+
+    if job.kind == SyncJob.KIND_LIBRARY:
+        with metrics.timed('sync_step_seconds', step='plan'):
+            subscriptions = ytmusic_client.get_library_subscriptions(limit=settings.SYNC_SUBSCRIPTION_LIMIT)
+        tasks = [
+            SyncTask(job=job, kind=SyncTask.KIND_ARTIST, target_id=sub['browseId'], name=sub.get('artist'))
+            for sub in subscriptions
+        ]
+    else:
+        stale = timezone.now() - timedelta(seconds=settings.SYNC_ALBUM_REFRESH_AGE)
+        albums = Album.objects.filter(
+            Q(need_tracks=True) | Q(last_synced__isnull=True) | Q(last_synced__lt=stale)
+        ).exclude(browseId='None').values_list('browseId', 'title')
+        tasks = [
+            SyncTask(job=job, kind=SyncTask.KIND_ALBUM, target_id=browse_id, name=title)
+            for browse_id, title in albums
+        ]
+    SyncTask.objects.bulk_create(tasks, ignore_conflicts=True)
+    logger.info(f"Planned {len(tasks)} tasks for sync job {job.id}")
+
+
+def sync_artist(ytmusic_client, channel_id):
+    artist_info = ytmusic_client.get_artist(channel_id)
+    artist, created = Artist.objects.get_or_create(
+        channelId=artist_info['channelId'], defaults={'name': artist_info['name']},
+    )
+    changed = artist.sync(artist_info, ytmusic_client)
+    logger.info(f"Artist {artist.name}, new: {created}, discography changed: {changed}")
+    return artist
+
+
+def sync_album(ytmusic_client, browse_id):
+    for album in Album.objects.filter(browseId=browse_id):
+        album.refresh_tracks(ytmusic_client)
+
+
+TASK_HANDLERS = {
+    SyncTask.KIND_ARTIST: sync_artist,
+    SyncTask.KIND_ALBUM: sync_album,
+}
+
+
+def start_task(task):
+    SyncTask.objects.filter(id=task.id).update(
+        status=SyncTask.STATUS_RUNNING, attempts=task.attempts + 1, updated_at=timezone.now()
+    )
+    task.attempts += 1
+
+
+def finish_task(task, error=None):
+    """Record the outcome of a task, putting failed ones back in the queue until they run out of attempts"""
+    if error is None:
+        task.status = SyncTask.STATUS_DONE
+        task.last_error = None
+    else:
+        logger.warning(f"Sync task {task} failed on attempt {task.attempts}: {error}")
+        if task.attempts >= settings.SYNC_MAX_ATTEMPTS:
+            task.status = SyncTask.STATUS_FAILED
+        else:
+            task.status = SyncTask.STATUS_PENDING
+        task.last_error = str(error)
+    task.save(update_fields=['status', 'last_error', 'updated_at'])
+    return error is None
+
+
+def run_task(task, ytmusic_client):
+    """Run one task, recording the failure on the task instead of raising"""
+    start_task(task)
+    try:
+        with metrics.timed('sync_step_seconds', step=task.kind):
+            TASK_HANDLERS[task.kind](ytmusic_client, task.target_id)
+    except YTMusicAuthError:
+        raise
+    except Exception as e:
+        return finish_task(task, e)
+    return finish_task(task)
+
+
+def finish_job(job, error=None):
+    if error is not None:
+        logger.error(f"Sync job {job.id} failed: {error}")
+        job.status = SyncJob.STATUS_FAILED
+        job.error = str(error)
+        job.tasks.filter(status=SyncTask.STATUS_RUNNING).update(status=SyncTask.STATUS_PENDING)
+    else:
+        job.status = SyncJob.STATUS_DONE
+        if job.tasks.filter(status=SyncTask.STATUS_FAILED).exists():
+            job.error = "Some items could not be synced"
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at', 'updated_at'])
+    if job.started_at:
+        metrics.observe(
+            'sync_job_seconds', (job.finished_at - job.started_at).total_seconds(), kind=job.kind, status=job.status,
+        )
+
+    if job.kind == SyncJob.KIND_LIBRARY and job.status == SyncJob.STATUS_DONE:
+        job.user.ytmusic_auth.has_updated_info = True
+        job.user.ytmusic_auth.save(update_fields=['has_updated_info'])
+    logger.info(f"Finished {job}, API rate {get_rate_limiter().stats()}")
+    return job
+
+
+def job_client(job):
+    """
+    The client a job runs with. Jobs that look for changes (library syncs
+    after the first one and album refreshes) compare fingerprints, so they
+    skip the response cache and see YouTube Music's current answers.
+    """
+    refresh = job.kind == SyncJob.KIND_ALBUMS or (
+        job.kind == SyncJob.KIND_LIBRARY
+        and YtmusicAuth.objects.filter(user=job.user, has_updated_info=True).exists()
+    )
+    return get_user_ytmusic_client(job.user, refresh=refresh)
+
+
+def run_job(job, ytmusic_client=None):
+    """
+    Process every outstanding task of a claimed job, retrying failures with
+    backoff. The job_client() of its user is used unless one is passed in.
+    """
+    logger.info(f"Starting {job}")
+    try:
+        ytmusic_client = ytmusic_client or job_client(job)
+        plan_tasks(job, ytmusic_client)
+
+        while True:
+            pending = list(job.tasks.filter(status=SyncTask.STATUS_PENDING))
+            if not pending:
+                break
+            for task in pending:
+                if task.attempts:
+                    time.sleep(settings.SYNC_RETRY_BACKOFF * task.attempts)
+                run_task(task, ytmusic_client)
+                if job.kind not in SyncJob.PRIORITY_KINDS:
+                    run_priority_jobs()
+    except Exception as e:
+        return finish_job(job, e)
+    return finish_job(job)
+
+
+def run_priority_jobs():
+    """Let albums someone is waiting on jump ahead of a long library sync"""
+    while True:
+        job = claim_next_job(kinds=SyncJob.PRIORITY_KINDS)
+        if job is None:
+            return
+        run_job(job)
+
+
+def fetch_cover_art():
+    """
+    One idle pass of the cover art pipeline. A failure is logged, not
+    raised, so the worker goes on syncing. Returns the number of images stored.
+    """
+    try:
+        return covers.fetch_missing(limit=settings.COVER_ART_BATCH)
+    except Exception:
+        logger.exception("Cover art pass failed")
+        return 0
+
+
+def run_worker(poll_interval=None, once=False):
+    """Main loop of the sync worker started by the run_sync_worker command"""
+    poll_interval = poll_interval or settings.SYNC_POLL_INTERVAL
+    recover_interrupted()
+    while True:
+        job = claim_next_job()
+        if job is not None:
+            run_job(job)
+            continue
+        # Cover art is fetched while there is nothing to sync, a batch at a time
+        if fetch_cover_art():
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
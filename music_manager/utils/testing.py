@@ -0,0 +1,43 @@
+# utils/testing.py
+"""
+Throwaway databases for the test suite and the benchmarks. The apps'
+migrations don't cover their current models (installs make their own
+with makemigrations), so these databases are created straight from the
+models instead.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from music_manager.utils import metrics, search
+
+UNMIGRATED_APPS = {'music_manager': None, 'downloader': None}
+
+
+def models_only():
+    """Settings override under which create_test_db builds the apps' tables from the models"""
+    return override_settings(MIGRATION_MODULES=UNMIGRATED_APPS)
+
+
+class ModelsOnlyTestRunner(DiscoverRunner):
+    """
+    TEST_RUNNER that builds the test databases from the models, see
+    models_only(). Metrics recorded by the tests stay out of METRICS_DIR.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._no_metrics_dir = override_settings(METRICS_DIR=None)
+        self._no_metrics_dir.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._no_metrics_dir.disable()
+        # Otherwise they would be flushed to the real METRICS_DIR when the process exits
+        metrics.registry.clear()
+        super().teardown_test_environment(**kwargs)
+
+    def setup_databases(self, **kwargs):
+        with models_only():
+            old_config = super().setup_databases(**kwargs)
+        # The FTS table is made on first use, which inside a test's transaction would be rolled back with it
+        search.get_index()
+        return old_config
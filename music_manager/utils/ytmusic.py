@@ -1,8 +1,17 @@
 # utils/ytmusic.py
+import threading
+import time
+from functools import partial
+
+import requests
+from requests.adapters import HTTPAdapter
 from django.core.exceptions import ObjectDoesNotExist
 from ytmusicapi import YTMusic
 from django.conf import settings
 from music_manager.models import YtmusicAuth, YTMusicAuthError
+from music_manager.utils.cache import CachedClient, get_response_cache
+from music_manager.utils.metrics import InstrumentedClient
+from music_manager.utils.ratelimit import RateLimitedClient, get_rate_limiter
 
 #class YTMusicManager:
 #    @classmethod
@@ -21,13 +30,68 @@ from music_manager.models import YtmusicAuth, YTMusicAuthError
 
 
 
-def get_user_ytmusic_client(user):
+class _PooledClient:
+    def __init__(self, client, updated_at):
+        self.client = client
+        self.updated_at = updated_at
+        self.last_used = time.monotonic()
+
+
+# user id -> _PooledClient, shared by every request handled by this process
+_client_pool = {}
+_client_pool_lock = threading.Lock()
+
+
+def make_requests_session():
+    """A session whose connection pool is big enough for the fetch pool"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.YTMUSIC_MAX_WORKERS)
+    session.mount('https://', adapter)
+    session.request = partial(session.request, timeout=settings.YTMUSIC_REQUEST_TIMEOUT)
+    return session
+
+
+def _evict_idle_clients(now):
+    for user_id, pooled in list(_client_pool.items()):
+        if now - pooled.last_used > settings.YTMUSIC_CLIENT_IDLE_TIMEOUT:
+            del _client_pool[user_id]
+
+
+def get_pooled_client(auth):
+    """
+    Return the rate limited YTMusic client for this auth, reusing the one
+    (and its HTTP connections) built earlier unless the auth has been
+    updated since or it sat idle for longer than YTMUSIC_CLIENT_IDLE_TIMEOUT
+    """
+    with _client_pool_lock:
+        now = time.monotonic()
+        _evict_idle_clients(now)
+        pooled = _client_pool.get(auth.user_id)
+        if pooled is None or pooled.updated_at != auth.updated_at:
+            client = auth.get_ytmusic_client(requests_session=make_requests_session())
+            pooled = _PooledClient(RateLimitedClient(InstrumentedClient(client), get_rate_limiter()), auth.updated_at)
+            _client_pool[auth.user_id] = pooled
+        pooled.last_used = now
+        return pooled.client
+
+
+def clear_client_pool(user=None):
+    with _client_pool_lock:
+        if user is None:
+            _client_pool.clear()
+        else:
+            _client_pool.pop(user.id, None)
+
+
+def get_user_ytmusic_client(user, refresh=False):
     """
-    Helper function to get a YTMusic client for a given user
+    Helper function to get a YTMusic client for a given user. Public endpoints
+    are answered from the response cache (skipped with refresh=True) and the
+    calls that do reach the API share the process wide adaptive rate limiter.
     """
     try:
-        auth = YtmusicAuth.objects.get(user=user)
-        return auth.get_ytmusic_client()
+        auth = YtmusicAuth.objects.only('user_id', 'auth_file', 'updated_at').get(user=user)
+        return CachedClient(get_pooled_client(auth), get_response_cache(), bypass=refresh)
     except ObjectDoesNotExist:
         raise YTMusicAuthError("User has not set up YTMusic authentication")
     except Exception as e:
@@ -1,12 +1,23 @@
 import os
+from datetime import timedelta
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.shortcuts import render, redirect
-from django.contrib.auth.decorators import login_required
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.template.loader import render_to_string
+from django.contrib.auth.decorators import login_not_required, login_required
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import etag, require_POST
 from django.contrib import messages
-from django.db.models import Avg, Count, Q, Exists, OuterRef, Subquery
+from django.db.models import Avg, Count, Q, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.contenttypes.models import ContentType
+from downloader.models import DownloadQueue
 from .models import *
-from .utils.ytmusic import get_user_ytmusic_client, get_albums, get_number_albums
+from .utils import covers, metrics, search
+from .utils.pagination import keyset_page
+from .utils.ytmusic import get_user_ytmusic_client
 from ytmusicapi import YTMusic
 
 
@@ -36,55 +47,13 @@ def ytmusic_callback(request):
 
 
 def home(request):
-    artist_content_type = ContentType.objects.get_for_model(Artist)
-    song_content_type = ContentType.objects.get_for_model(Song)
-
-    # Top artists
-    top_artist_ids = UserRating.objects.filter(
-        user=request.user,
-        content_type=artist_content_type,
-        rating__gte=3
-    ).values('object_id').annotate(
-        avg_rating=Avg('rating'),
-        rating_count=Count('id')
-    ).order_by('-avg_rating')[:5].values_list('object_id', flat=True)
-
-    top_artists = Artist.objects.filter(id__in=top_artist_ids).annotate(
-        avg_rating=Subquery(
-            UserRating.objects.filter(
-                user=request.user,
-                content_type=artist_content_type,
-                object_id=OuterRef('pk')
-            ).values('object_id').annotate(
-                avg=Avg('rating')
-            ).values('avg')[:1]
-        )
-    ).order_by('-avg_rating')
-
-    # Top songs
-    top_song_ids = UserRating.objects.filter(
-        user=request.user,
-        content_type=song_content_type
-    ).values('object_id').annotate(
-        avg_rating=Avg('rating')
-    ).order_by('-avg_rating')[:10].values_list('object_id', flat=True)
-
-    top_songs = Song.objects.filter(id__in=top_song_ids).annotate(
-        avg_rating=Subquery(
-            UserRating.objects.filter(
-                user=request.user,
-                content_type=song_content_type,
-                object_id=OuterRef('pk')
-            ).values('object_id').annotate(
-                avg=Avg('rating')
-            ).values('avg')[:1]
-        )
-    ).order_by('-avg_rating')
+    top_artists = top_rated(request.user, Artist, 5, min_rating=3)
+    top_songs = top_rated(request.user, Song, 10, queryset=Song.objects.prefetch_related('primary_artists'))
 
     # Recent favorites (unchanged)
     recent_favorites = UserFavorite.objects.filter(
         user=request.user
-    ).order_by('-date_favorited')[:5]
+    ).with_content_objects().order_by('-date_favorited')[:5]
 
     context = {
         'top_artists': top_artists,
@@ -97,34 +66,29 @@ def home(request):
 def manage_artists(request):
     artist_content_type = ContentType.objects.get_for_model(Artist)
 
-    # Get artist IDs that have either ratings or favorites
+    # Artists that have either ratings or favorites, both read from the per-user indexes
     rated_artist_ids = UserRating.objects.filter(
         user=request.user,
         content_type=artist_content_type
-    ).values_list('object_id', flat=True).distinct()
+    ).values('object_id')
 
     favorited_artist_ids = UserFavorite.objects.filter(
         user=request.user,
         content_type=artist_content_type
-    ).values_list('object_id', flat=True).distinct()
-
-    all_artist_ids = set(rated_artist_ids).union(set(favorited_artist_ids))
+    ).values('object_id')
 
     subscribed_artists = Artist.objects.filter(
-        id__in=all_artist_ids
-    ).prefetch_related(
-        'albums',
-        'albums__songs'
+        Q(id__in=rated_artist_ids) | Q(id__in=favorited_artist_ids)
     ).annotate(
         user_rating=Subquery(
             UserRating.objects.filter(
                 user=request.user,
                 content_type=artist_content_type,
                 object_id=OuterRef('pk')
-            ).values('object_id').annotate(
-                avg=Avg('rating')
-            ).values('avg')[:1]
+            ).values('rating')[:1]
         ),
+        # Unrated artists sort last, and the page cursor needs a non-null value
+        rating_rank=Coalesce('user_rating', Value(-6)),
         is_favorite=Exists(
             UserFavorite.objects.filter(
                 user=request.user,
@@ -132,10 +96,21 @@ def manage_artists(request):
                 object_id=OuterRef('pk')
             )
         )
-    ).order_by('-is_favorite', '-user_rating', 'name')
+    )
+    # Albums and songs are loaded per artist by artist_albums when expanded
+    subscribed_artists, next_cursor = keyset_page(
+        subscribed_artists,
+        ('-is_favorite', '-rating_rank', 'name', 'id'),
+        cursor=request.GET.get('after'),
+        size=request.GET.get('limit'),
+    )
 
     context = {
         'subscribed_artists': subscribed_artists,
+        'next_cursor': next_cursor,
+        'active_sync': SyncJob.objects.filter(
+            user=request.user, status__in=SyncJob.ACTIVE_STATUSES
+        ).exists(),
     }
     return render(request, 'music_manager/manage_artists.html', context)
 
@@ -145,7 +120,7 @@ def manage_likes(request):
     # Get all favorited items
     favorites = UserFavorite.objects.filter(
         user=request.user
-    ).select_related('content_type').order_by('-date_favorited')
+    ).with_content_objects().order_by('-date_favorited')
 
     # Organize favorites by type
     favorited_artists = []
@@ -182,58 +157,67 @@ def user_playlists(request):
         })
 
 
-def user_information(request):
-    try:
-        print("getting user ytmusic client")
-        ytmusic = get_user_ytmusic_client(request.user)
-
-        user_artists = ytmusic.get_library_subscriptions(limit=300)
-        current_number = 1
-        max_number = len(user_artists)
-        for i in user_artists:
-            artist_info = ytmusic.get_artist(i['browseId'])
-            new_artist, created = Artist.objects.get_or_create(channelId=artist_info['channelId'])
-            new_artist.populate(artist_info)
-            print('Artist %s out of %s : %s, New: %s' % (current_number, max_number, new_artist.name, created))
-            new_artist.save() 
-            new_artist.get_discography(ytmusic)
-            current_number += 1
-
-        return redirect('/manage_artists/')
-
-
-
-    except YTMusicAuthError as e:
+async def user_information(request):
+    user = await request.auser()
+    if not await YtmusicAuth.objects.filter(user=user).aexists():
         # Redirect to setup page if auth isn't configured
         return redirect('/ytmusic-auth/')
 
-def get_albums(request):
-    try:
-        print("getting user ytmusic client")
-        ytmusic = get_user_ytmusic_client(request.user)
-
-        albums = Album.objects.all()
-
-        for i in albums:
-            i.get_tracks(ytmusic)
-
-        return redirect('/manage_artists/')
-
-
+    # The sync worker (manage.py run_sync_worker) does the actual work
+    await sync_to_async(SyncJob.enqueue)(user, SyncJob.KIND_LIBRARY)
+    messages.info(request, 'Your YouTube Music library is syncing in the background.')
+    return redirect('/manage_artists/')
 
-    except YTMusicAuthError as e:
+async def get_albums(request):
+    user = await request.auser()
+    if not await YtmusicAuth.objects.filter(user=user).aexists():
         # Redirect to setup page if auth isn't configured
         return redirect('/ytmusic-auth/')
 
+    await sync_to_async(SyncJob.enqueue)(user, SyncJob.KIND_ALBUMS)
+    messages.info(request, 'Album track lists are syncing in the background.')
+    return redirect('/manage_artists/')
+
+@login_not_required
+def prometheus_metrics(request):
+    """Metrics of every web and worker process for Prometheus, for staff or a METRICS_TOKEN bearer"""
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def sync_progress(request):
+    """Progress of the user's most recent sync jobs, polled by manage_artists"""
+    jobs = {}
+    for kind, _ in SyncJob.KINDS:
+        job = SyncJob.objects.filter(user=request.user, kind=kind).first()
+        if job is not None:
+            jobs[kind] = job.progress()
+    return JsonResponse({
+        'jobs': jobs,
+        'active': any(job['status'] in SyncJob.ACTIVE_STATUSES for job in jobs.values()),
+    })
+
 def artists_information(request):
-    artists = Artist.objects.order_by("name")
+    artists, next_cursor = keyset_page(
+        Artist.objects.all(),
+        ('name', 'id'),
+        cursor=request.GET.get('after'),
+        size=request.GET.get('limit'),
+    )
 
-    context = {'artists' : artists,}
+    context = {
+        'artists' : artists,
+        'next_cursor' : next_cursor,
+    }
     return render(request, 'music_manager/artists.html', context=context)
 
 
 def artist_info(request, artist_slug):
-    artist = Artist.objects.get(slug=artist_slug)
+    artist = get_object_or_404(Artist, slug=artist_slug)
 
     albums = artist.albums.all()
 
@@ -245,15 +229,171 @@ def artist_info(request, artist_slug):
     return render(request, 'music_manager/artist.html', context=context)
 
 def album_info(request, artist_slug, album_slug):
-    album = Album.objects.get(slug=album_slug)
-    ytmusic = get_user_ytmusic_client(request.user)
-    album.get_tracks(ytmusic_client=ytmusic)
+    album = artist_album(artist_slug, album_slug)
 
-    songs = album.songs.all()
+    # Never call the API while rendering, the sync worker fetches missing tracks
+    tracks_status = queue_album_tracks(request.user, album) if album.need_tracks else None
 
     context = {
         'album' : album,
-        'songs' : songs,
+        'artist_slug' : artist_slug,
+        'songs' : album_songs(album),
+        'tracks_status' : tracks_status,
     }
 
-    return render(request, 'music_manager/album.html', context=context)
\ No newline at end of file
+    return render(request, 'music_manager/album.html', context=context)
+
+def album_tracks(request, artist_slug, album_slug):
+    """Track list fragment polled by the album page until the tracks arrive"""
+    album = artist_album(artist_slug, album_slug)
+    tracks_status = queue_album_tracks(request.user, album) if album.need_tracks else None
+
+    html = render_to_string('music_manager/album_tracks.html', {
+        'album': album,
+        'songs': album_songs(album),
+        'tracks_status': tracks_status,
+    }, request=request)
+    return JsonResponse({
+        'ready': not album.need_tracks,
+        # 'pending', 'running', or the terminal 'failed'/'unavailable' where polling stops
+        'status': tracks_status['status'] if tracks_status else 'done',
+        'error': tracks_status['error'] if tracks_status else None,
+        'html': html,
+    })
+
+@require_POST
+def download_song(request, song_id):
+    """Queue a song for the download worker, fetching its canonical URL the first time"""
+    song = get_object_or_404(Song, id=song_id)
+    try:
+        song.get_details(get_user_ytmusic_client(request.user))
+    except YTMusicAuthError as e:
+        messages.error(request, f'Could not look up {song.title}: {e}')
+        return redirect('music_manager:ytmusic_auth')
+
+    DownloadQueue.objects.create(user=request.user.get_username(), url=song.url)
+    messages.info(request, f'{song.title} is queued for download.')
+    return redirect('downloader:home')
+
+def search_library(request):
+    query = request.GET.get('q', '').strip()
+    hits = search.search(query, limit=settings.SEARCH_RESULTS_LIMIT) if query else []
+
+    ids = {kind: [object_id for hit_kind, object_id, _ in hits if hit_kind == kind] for kind in search.KINDS}
+    artists = Artist.objects.in_bulk(ids['artist'])
+    albums = Album.objects.prefetch_related('artists').in_bulk(ids['album'])
+    songs = Song.objects.prefetch_related('primary_artists', 'albums').in_bulk(ids['song'])
+    found = {'artist': artists, 'album': albums, 'song': songs}
+
+    # Keep the index's ranking, skipping anything deleted since it was indexed
+    results = [
+        {'kind': kind, 'object': found[kind][object_id]}
+        for kind, object_id, _ in hits
+        if object_id in found[kind]
+    ]
+    return render(request, 'music_manager/search.html', {
+        'query': query,
+        'results': results,
+    })
+
+def search_typeahead(request):
+    """Title suggestions for the search box, answered from the index alone"""
+    query = request.GET.get('q', '').strip()
+    hits = search.typeahead(query, limit=settings.SEARCH_TYPEAHEAD_LIMIT) if query else []
+    return JsonResponse({
+        'results': [{'kind': kind, 'id': object_id, 'title': title} for kind, object_id, title in hits],
+    })
+
+def artist_albums(request, artist_id):
+    """Albums fragment loaded when an artist is expanded, a page at a time"""
+    artist = get_object_or_404(Artist, id=artist_id)
+    albums, next_cursor = keyset_page(
+        artist.albums.all(),
+        ('title', 'id'),
+        cursor=request.GET.get('after'),
+        size=request.GET.get('limit'),
+    )
+    return render(request, 'music_manager/artist_albums.html', {
+        'artist': artist,
+        'albums': albums,
+        'next_cursor': next_cursor,
+    })
+
+def album_song_list(request, album_id):
+    """Songs fragment loaded when an album is expanded"""
+    album = get_object_or_404(Album, id=album_id)
+    songs = album_songs(album)[:settings.LIBRARY_MAX_PAGE_SIZE]
+    return render(request, 'music_manager/album_tracks.html', {
+        'album': album,
+        'songs': songs,
+    })
+
+@etag(lambda request, digest, size, extension: f'{digest}-{size}.{extension}')
+def cover_art(request, digest, size, extension):
+    """A cover thumbnail. Its URL is the content hash, so browsers may keep it for good."""
+    try:
+        path = covers.thumbnail_path(digest, size, extension)
+    except FileNotFoundError:
+        raise Http404("No such cover")
+    response = FileResponse(open(path, 'rb'), content_type=covers.FORMATS[extension][2])
+    response['Cache-Control'] = f'private, max-age={settings.COVER_ART_CACHE_SECONDS}, immutable'
+    return response
+
+def artist_album(artist_slug, album_slug):
+    """
+    An album by its slug among the artist's albums. Both slugs are indexed,
+    so this is an index lookup on each side of the album/artist join. An
+    existing album linked to a second artist can clash with one of theirs,
+    the older album wins.
+    """
+    album = Album.objects.filter(artists__slug=artist_slug, slug=album_slug).order_by('id').first()
+    if album is None:
+        raise Http404("No such album")
+    return album
+
+def album_songs(album):
+    return album.songs.order_by('albumsong__disc_number', 'albumsong__track_number')
+
+def queue_album_tracks(user, album):
+    """
+    Queue the album's track list for the sync worker and return the status of
+    its task as {'status', 'error'}. An album whose last attempt failed isn't
+    queued again until SYNC_ALBUM_RETRY_AFTER has passed, so a page polling
+    it gets a final 'failed' instead of re-queuing it every poll.
+    """
+    if not YtmusicAuth.objects.filter(user=user).exists():
+        return {'status': 'unavailable', 'error': "Connect YouTube Music to fetch this album's tracks."}
+
+    task = SyncTask.objects.filter(
+        job__user=user, kind=SyncTask.KIND_ALBUM, target_id=album.browseId,
+    ).select_related('job').order_by('-id').first()
+    retry_after = timezone.now() - timedelta(seconds=settings.SYNC_ALBUM_RETRY_AFTER)
+    if task is not None and task.status == SyncTask.STATUS_FAILED and task.updated_at > retry_after:
+        return {'status': task.status, 'error': task.last_error or "Fetching the tracks failed."}
+    if task is None or not task.job.is_active:
+        job = SyncJob.enqueue_album(user, album)
+        task = job.tasks.get(kind=SyncTask.KIND_ALBUM, target_id=album.browseId)
+    return {'status': task.status, 'error': task.last_error if task.status == SyncTask.STATUS_FAILED else None}
+
+def top_rated(user, model, limit, queryset=None, min_rating=None):
+    """
+    The user's highest rated objects of one model, each with its rating as
+    avg_rating. Reads the ratings straight from the (user, content_type,
+    rating) index instead of averaging them per object.
+    """
+    ratings = UserRating.objects.filter(
+        user=user,
+        content_type=ContentType.objects.get_for_model(model),
+    )
+    if min_rating is not None:
+        ratings = ratings.filter(rating__gte=min_rating)
+    top = list(ratings.order_by('-rating').values_list('object_id', 'rating')[:limit])
+
+    objects = (queryset if queryset is not None else model.objects).in_bulk([object_id for object_id, _ in top])
+    rated = []
+    for object_id, rating in top:
+        if object_id in objects:
+            obj = objects[object_id]
+            obj.avg_rating = rating
+            rated.append(obj)
+    return rated